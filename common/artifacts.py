@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+'''Content-addressed cache of pipeline artifacts.
+
+Every stage output (random samples, PCA, vocabulary, features, BoVWs,
+index...) is named after a hash of the stage name, its parameters and the
+keys of the artifacts it was computed from, e.g.
+
+    samples = cache.artifact('samples', {'n_samples': 100000})
+    pca = cache.artifact('pca', {'dim': 32}, deps=[samples])
+    if not pca.exists:
+        save_data(fit_pca(...), pca.path)
+
+Changing a parameter changes the key of its stage and of everything
+downstream, so only those stages are recomputed; artifacts of other
+parameter values stay in the cache. A small .json manifest next to every
+artifact records what it was computed from.
+'''
+from __future__ import print_function
+from __future__ import division
+
+import hashlib
+import json
+import os
+from os.path import exists, join
+
+
+def _canonical(params):
+    # stable text for dicts/lists of basic types (numpy scalars included)
+    return json.dumps(params, sort_keys=True, default=str)
+
+
+def digest(items):
+    '''Short hash of a list of strings, e.g. an image list.'''
+    h = hashlib.sha1()
+    for item in items:
+        h.update(item.encode('utf-8'))
+        h.update(b'\n')
+    return h.hexdigest()[:12]
+
+
+class Artifact(object):
+
+    def __init__(self, cache, stage, params, deps, ext):
+        self.stage = stage
+        self.params = params
+        self.deps = [d.key if isinstance(d, Artifact) else d for d in deps]
+        text = _canonical({'stage': stage, 'params': params, 'deps': self.deps})
+        self.key = hashlib.sha1(text.encode('utf-8')).hexdigest()[:12]
+        self.path = join(cache.root, '{}_{}{}'.format(stage, self.key, ext))
+        self._manifest = join(cache.root, '{}_{}.json'.format(stage, self.key))
+
+    @property
+    def exists(self):
+        return exists(self.path)
+
+    def record(self):
+        '''Write the manifest (stage, parameters, dependencies).'''
+        with open(self._manifest, 'w') as fh:
+            json.dump({'stage': self.stage, 'params': self.params,
+                       'deps': self.deps, 'path': self.path}, fh,
+                      sort_keys=True, indent=1, default=str)
+
+    def __repr__(self):
+        return 'Artifact({})'.format(self.path)
+
+
+class ArtifactCache(object):
+
+    def __init__(self, root):
+        self.root = root
+        if not exists(root):
+            os.makedirs(root)
+
+    def artifact(self, stage, params=None, deps=(), ext='.dat'):
+        '''Artifact of `stage` computed with `params` (a JSON-able dict) from
+        the artifacts (or keys) in `deps`.'''
+        artifact = Artifact(self, stage, params or {}, deps, ext)
+        if not exists(artifact._manifest):
+            artifact.record()
+        return artifact
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+from __future__ import division
+
+import numpy as np
+
+from dtypes import FLOAT
+
+
+class WordAssigner(object):
+    '''Nearest visual word assignment through dot-products.
+
+    ||x - c||^2 = ||x||^2 - 2 x.c + ||c||^2 and ||x||^2 is the same for all
+    words, so the nearest word is argmax(x.c - ||c||^2 / 2); the squared norms
+    of the words are computed once. If the words are unit-norm the bias term
+    vanishes, and if the descriptors are also unit-norm the distance is just
+    2 * (1 - x.c). Descriptors are processed in blocks of `block_size` rows,
+    so only a (block_size x n_words) matrix is kept in memory.
+    '''
+
+    def __init__(self, vocabulary, unit_norm=None, block_size=4096,
+                 dtype=FLOAT):
+        self.vocabulary = np.ascontiguousarray(vocabulary, dtype=dtype)
+        self.block_size = block_size
+        self.dtype = dtype
+
+        sq_norms = np.einsum('ij,ij->i', self.vocabulary, self.vocabulary)
+        # unit_norm=True declares both descriptors and words L2-normalized,
+        # None detects it on the words only
+        if unit_norm is None:
+            self.unit_words = bool(np.allclose(sq_norms, 1., atol=1e-4))
+        else:
+            self.unit_words = unit_norm
+        self.unit_norm = bool(unit_norm)
+        self.half_sq_norms = None if self.unit_words else 0.5 * sq_norms
+
+    @property
+    def n_words(self):
+        return self.vocabulary.shape[0]
+
+    @property
+    def ndim(self):
+        return self.vocabulary.shape[1]
+
+    def assign(self, desc, return_dist=False):
+        '''Index of the nearest word for every descriptor, plus the squared
+        distance to it if return_dist is set.'''
+        desc = np.atleast_2d(np.asarray(desc, dtype=self.dtype))
+        if desc.shape[1] != self.ndim:
+            raise ValueError('descriptors and vocabulary dimensionality differ')
+
+        n = desc.shape[0]
+        words = np.empty(n, dtype=np.int64)
+        dist2 = np.empty(n, dtype=self.dtype) if return_dist else None
+
+        for start in range(0, n, self.block_size):
+            block = desc[start:start + self.block_size]
+            sim = np.dot(block, self.vocabulary.T)
+            if self.half_sq_norms is not None:
+                sim -= self.half_sq_norms
+            best = np.argmax(sim, axis=1)
+            words[start:start + len(block)] = best
+
+            if return_dist:
+                sim = sim[np.arange(len(block)), best]
+                if self.unit_norm:
+                    d2 = 2 * (1 - sim)
+                else:
+                    d2 = np.einsum('ij,ij->i', block, block) - 2 * sim
+                    if self.half_sq_norms is None:
+                        d2 += 1
+                # rounding may give tiny negative values
+                dist2[start:start + len(block)] = np.maximum(d2, 0)
+
+        if return_dist:
+            return words, dist2
+        return words
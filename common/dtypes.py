@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+'''Floating point type of the feature pipelines.
+
+Descriptors, projections, vocabularies and scores are all computed in FLOAT,
+float32 unless the BOVW_FLOAT environment variable says otherwise (e.g.
+BOVW_FLOAT=float64 to check numerical issues). On-disk formats keep their
+own fixed types.
+'''
+from __future__ import print_function
+from __future__ import division
+
+import os
+
+import numpy as np
+
+FLOAT = np.dtype(os.environ.get('BOVW_FLOAT', 'float32'))
+if FLOAT not in (np.float32, np.float64):
+    raise ValueError('BOVW_FLOAT must be float32 or float64, not {}'.format(FLOAT))
+
+
+def as_float(x):
+    '''x as a FLOAT array (no copy if it already is one).'''
+    return np.asarray(x, dtype=FLOAT)
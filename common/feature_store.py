@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+'''Append-only store for the local features of a whole image collection.
+
+The store is a directory with:
+
+  desc.bin   descriptors of all the images, concatenated (n_total x ndim)
+  kp.bin     keypoints (x, y, size, angle, or only their first kp_dim
+             columns), aligned with desc.bin
+  table.bin  (start, count) int64 rows, one per image
+  names.txt  image names, aligned with table.bin
+  meta.txt   ndim, kp_dim, dtype and kp_dtype (float32 if missing)
+
+The arrays are read through np.memmap, so getting the features of an image is
+a slice of the mapped files, without parsing or copying anything.
+'''
+from __future__ import print_function
+from __future__ import division
+
+import os
+from os.path import exists, getsize, join
+
+import numpy as np
+
+from dtypes import FLOAT
+from parallel import imap_progress
+
+
+class FeatureStore(object):
+
+    def __init__(self, path, ndim=None, kp_dim=4, dtype=FLOAT, kp_dtype=np.float32):
+        self.path = path
+        meta_file = join(path, 'meta.txt')
+        if exists(meta_file):
+            with open(meta_file) as fh:
+                meta = fh.read().split()
+            ndim, kp_dim, dtype = int(meta[0]), int(meta[1]), meta[2]
+            kp_dtype = meta[3] if len(meta) > 3 else np.float32
+        elif ndim is None:
+            raise IOError('{} is not a feature store'.format(path))
+        else:
+            if not exists(path):
+                os.makedirs(path)
+            with open(meta_file, 'w') as fh:
+                fh.write('{} {} {} {}\n'.format(ndim, kp_dim, np.dtype(dtype).name,
+                                                np.dtype(kp_dtype).name))
+
+        self.ndim = ndim
+        self.kp_dim = kp_dim
+        self.dtype = np.dtype(dtype)
+        self.kp_dtype = np.dtype(kp_dtype)
+
+        self._recover()
+        self._maps = None
+
+    def _file(self, name):
+        return join(self.path, name)
+
+    def _recover(self):
+        # drop whatever an interrupted append left after the last full record
+        names = []
+        if exists(self._file('names.txt')):
+            with open(self._file('names.txt')) as fh:
+                names = fh.read().split('\n')[:-1]
+        table = np.zeros((0, 2), dtype=np.int64)
+        if exists(self._file('table.bin')):
+            table = np.fromfile(self._file('table.bin'), dtype=np.int64)
+            table = table[:len(table) // 2 * 2].reshape(-1, 2)
+
+        n = min(len(names), len(table))
+        self.names = names[:n]
+        self.table = [tuple(entry) for entry in table[:n].tolist()]
+        self.n_rows = sum(self.table[-1]) if n > 0 else 0
+        self.ids = dict((name, i) for i, name in enumerate(self.names))
+
+        sizes = [('desc.bin', self.n_rows * self.ndim * self.dtype.itemsize),
+                 ('kp.bin', self.n_rows * self.kp_dim * self.kp_dtype.itemsize),
+                 ('table.bin', n * 16)]
+        for fname, size in sizes:
+            if not exists(self._file(fname)) or getsize(self._file(fname)) > size:
+                with open(self._file(fname), 'ab') as fh:
+                    fh.truncate(size)
+        if len(names) > n or not exists(self._file('names.txt')):
+            with open(self._file('names.txt'), 'w') as fh:
+                fh.write(''.join(name + '\n' for name in self.names))
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self.ids
+
+    def append(self, name, desc, kp=None):
+        if name in self.ids:
+            raise ValueError('{} already in the store'.format(name))
+        desc = np.asarray(desc, dtype=self.dtype).reshape(-1, self.ndim)
+        if kp is None:
+            kp = np.zeros((len(desc), self.kp_dim), dtype=self.kp_dtype)
+        kp = np.asarray(kp, dtype=self.kp_dtype).reshape(len(desc), self.kp_dim)
+
+        # data first, then the table entry that makes it visible
+        with open(self._file('desc.bin'), 'ab') as fh:
+            fh.write(desc.tobytes())
+        with open(self._file('kp.bin'), 'ab') as fh:
+            fh.write(kp.tobytes())
+        entry = np.array([self.n_rows, len(desc)], dtype=np.int64)
+        with open(self._file('table.bin'), 'ab') as fh:
+            fh.write(entry.tobytes())
+        with open(self._file('names.txt'), 'a') as fh:
+            fh.write(name + '\n')
+
+        self.ids[name] = len(self.names)
+        self.names.append(name)
+        self.table.append((self.n_rows, len(desc)))
+        self.n_rows += len(desc)
+        self._maps = None
+
+    def _map(self, fname, dtype, ncols):
+        if ncols == 0 or self.n_rows == 0:
+            return np.zeros((self.n_rows, ncols), dtype=dtype)
+        return np.memmap(self._file(fname), dtype=dtype, mode='r',
+                         shape=(self.n_rows, ncols))
+
+    def get(self, name):
+        '''{'desc': ..., 'kp': ...} of an image, as read-only memmap slices.'''
+        if self._maps is None:
+            self._maps = (self._map('desc.bin', self.dtype, self.ndim),
+                          self._map('kp.bin', self.kp_dtype, self.kp_dim))
+        start, count = self.table[self.ids[name]]
+        desc, kp = self._maps
+        return {'desc': desc[start:start + count],
+                'kp': kp[start:start + count]}
+
+
+def extract_features(extract_job, base_path, im_list, store_path, n_workers=None,
+                     kp_dim=4):
+    '''Compute the local features of the images of im_list not in the store
+    at store_path yet and return the store. extract_job((fname, imfile)),
+    a module-level function run on n_workers processes, returns
+    (fname, desc, kp) with kp=None if there are no keypoints; this process
+    appends the results to the store.'''
+    store = FeatureStore(store_path) if exists(store_path) else None
+    jobs = [(fname, join(base_path, fname)) for fname in im_list
+            if store is None or fname not in store]
+
+    print('{} images already in {}'.format(len(im_list) - len(jobs), store_path))
+    n_features = 0
+    for fname, desc, kp in imap_progress(extract_job, jobs, n_workers,
+                                         label='extracting features'):
+        if store is None:
+            store = FeatureStore(store_path, ndim=desc.shape[1], kp_dim=kp_dim)
+        store.append(fname, desc, kp)
+        n_features += len(desc)
+    print('{} images: {} features'.format(len(jobs), n_features))
+    return store
+
+
+def iter_feature_batches(store, im_list, batch_size, n_per_file=100,
+                         random_state=None):
+    # endless stream of batches of local features, drawn n_per_file at a
+    # time from random images, so that only a few images are in memory
+    if random_state is None:
+        random_state = np.random.RandomState()
+
+    buffer, n_buffered = [], 0
+    while True:
+        while n_buffered < batch_size:
+            i = random_state.randint(0, len(im_list))
+            feat = store.get(im_list[i])['desc']
+            idxs = random_state.choice(feat.shape[0], min(n_per_file, feat.shape[0]),
+                                       replace=False)
+            buffer.append(feat[idxs])
+            n_buffered += len(idxs)
+
+        batch = np.vstack(buffer)
+        yield batch[:batch_size]
+        buffer, n_buffered = [batch[batch_size:]], len(batch) - batch_size
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+'''Additive kernels for histograms and their explicit feature maps.
+
+Vedaldi, A., & Zisserman, A. (2012). Efficient additive kernels via explicit
+feature maps. IEEE TPAMI, 34(3), 480-492.
+
+An additive kernel K(x, y) = sum_i k(x_i, y_i) whose k is homogeneous,
+k(cx, cy) = c k(x, y), is determined by its spectrum kappa(lambda). Sampling
+the spectrum at 0, L, 2L, ..., nL gives a 2n+1 dimensional map psi with
+k(x, y) ~= psi(x).psi(y), so a linear SVM on the mapped histograms
+approximates the kernel SVM at the cost of a linear one.
+'''
+from __future__ import print_function
+from __future__ import division
+
+import numpy as np
+
+from dtypes import FLOAT, as_float
+
+KERNELS = ('intersection', 'chi2', 'hellinger')
+
+
+def chi2(x, y):
+    # 2xy / (x + y), 0 where both are 0
+    s = x + y
+    return np.where(s > 0, 2 * x * y / np.where(s > 0, s, 1), 0)
+
+
+def hellinger(x, y):
+    return np.sqrt(x * y)
+
+
+# element-wise k(x_i, y_i) of every kernel
+ADDITIVE = {'intersection': np.minimum, 'chi2': chi2, 'hellinger': hellinger}
+
+
+# sampling period L giving a good approximation with a few terms
+PERIODS = {'intersection': 0.8, 'chi2': 0.5}
+
+
+def spectrum(kernel, lam):
+    '''kappa(lambda) of the homogeneous kernel.'''
+    if kernel == 'intersection':
+        return 2. / (np.pi * (1 + 4 * lam ** 2))
+    if kernel == 'chi2':
+        return 1. / np.cosh(np.pi * lam)
+    raise ValueError('no spectrum for kernel {}'.format(kernel))
+
+
+def kernel_map(X, kernel='chi2', order=2, period=None):
+    '''Approximate feature map of the (non-negative) histograms in X, every
+    dimension expanded to 2 * order + 1 (the Hellinger map is exact:
+    sqrt(x), one dimension).'''
+    if kernel not in KERNELS:
+        raise ValueError('unknown kernel: {}'.format(kernel))
+    X = as_float(X)
+    if kernel == 'hellinger':
+        return np.sqrt(X)
+
+    if period is None:
+        period = PERIODS[kernel]
+    n, d = X.shape
+    psi = np.zeros((n, d, 2 * order + 1), dtype=FLOAT)
+    # psi(0) = 0; log() only where x > 0
+    nz = X > 0
+    x = X[nz]
+    log_x = np.log(x)
+    psi[nz, 0] = np.sqrt(x * period * spectrum(kernel, 0.))
+    for j in range(1, order + 1):
+        amplitude = np.sqrt(2 * x * period * spectrum(kernel, j * period))
+        psi[nz, 2 * j - 1] = amplitude * np.cos(j * period * log_x)
+        psi[nz, 2 * j] = amplitude * np.sin(j * period * log_x)
+    return psi.reshape(n, -1)
+
+
+def additive_kernel(X, Y, kernel='intersection'):
+    '''Exact Gram matrix sum_i k(X[a, i], Y[b, i]) (small inputs).'''
+    k = ADDITIVE[kernel]
+    return k(as_float(X)[:, None, :], as_float(Y)[None, :, :]).sum(axis=2)
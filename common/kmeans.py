@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+'''k-means for visual vocabularies and quantizer codebooks.
+
+k-means++ seeding (Arthur & Vassilvitskii, 2007), Lloyd iterations with the
+nearest centroids found by a WordAssigner, and empty clusters reseeded on
+the samples worst represented by their centroid. minibatch_kmeans_fit()
+(Sculley, 2010) learns from a stream of sample batches instead.
+'''
+from __future__ import print_function
+from __future__ import division
+
+import numpy as np
+
+from scipy import sparse
+
+from assignment import WordAssigner
+from dtypes import FLOAT
+
+
+def kmeans_pp_init(samples, n_clusters, random_state=None):
+    # k-means++ seeding: each new centroid is drawn with probability
+    # proportional to the squared distance to the closest chosen centroid
+    if random_state is None:
+        random_state = np.random.RandomState()
+
+    n_samples = samples.shape[0]
+    idxs = [random_state.randint(0, n_samples)]
+    dist2 = np.sum((samples - samples[idxs[0]]) ** 2, axis=1, dtype=np.float64)
+    for _ in range(1, n_clusters):
+        total = dist2.sum()
+        if total > 0:
+            i = random_state.choice(n_samples, p=dist2 / total)
+        else:
+            i = random_state.randint(0, n_samples)
+        idxs.append(i)
+        dist2 = np.minimum(dist2, np.sum((samples - samples[i]) ** 2, axis=1,
+                                         dtype=np.float64))
+    return samples[idxs].astype(FLOAT)
+
+
+def cluster_sums(samples, assignment, n_clusters):
+    # per-cluster number of samples and sum of samples, the sums as one
+    # sparse (n_clusters x n_samples) membership matrix product
+    counts = np.bincount(assignment, minlength=n_clusters)
+    members = sparse.csr_matrix(
+        (np.ones(len(assignment)), (assignment, np.arange(len(assignment)))),
+        shape=(n_clusters, len(assignment)))
+    return counts, members.dot(samples)
+
+
+def reseed_empty(centroids, counts, samples, dist2):
+    # move empty clusters onto the samples worst represented by their centroid
+    empty = np.where(counts == 0)[0]
+    if len(empty) > 0:
+        far = np.argsort(-dist2)[:len(empty)]
+        centroids[empty[:len(far)]] = samples[far]
+    return len(empty)
+
+
+def kmeans_fit(samples, n_clusters, maxiter=100, tol=1e-4, init='k-means++',
+               random_state=None, verbose=True):
+    '''(n_clusters x ndim) centroids; stops when the mean squared distance
+    to the centroids decreases by less than tol (relative).'''
+    if random_state is None:
+        random_state = np.random.RandomState()
+
+    n_samples = samples.shape[0]
+
+    if init == 'k-means++':
+        centroids = kmeans_pp_init(samples, n_clusters, random_state)
+    else:
+        # chose random samples as initial estimates
+        idxs = random_state.randint(0, n_samples, n_clusters)
+        centroids = samples[idxs, :].astype(FLOAT)
+
+    J_old = np.inf
+    for iter_ in range(maxiter):
+
+        # SAMPLE-TO-CLUSTER ASSIGNMENT
+
+        # nearest centroid of every sample and (squared) distance to it,
+        # computed in blocks (see WordAssigner)
+        assignment, dist2 = WordAssigner(centroids).assign(samples, return_dist=True)
+
+        # CENTROIDS UPDATE (+ EVAL DISTORTION)
+
+        J_new = np.sum(dist2, dtype=np.float64) / n_samples
+
+        counts, sums = cluster_sums(samples, assignment, n_clusters)
+        nonempty = counts > 0
+        centroids[nonempty] = sums[nonempty] / counts[nonempty, None]
+        n_empty = reseed_empty(centroids, counts, samples, dist2)
+        if verbose and n_empty > 0:
+            print('iteration {}, {} empty clusters reseeded'.format(iter_, n_empty))
+
+        if verbose:
+            print('iteration {}, potential={:.3e}'.format(iter_, J_new))
+        if n_empty == 0 and J_old - J_new <= tol * J_new:
+            if verbose:
+                print('STOP')
+            break
+        J_old = J_new
+
+    return centroids
+
+
+def minibatch_kmeans_fit(batches, n_clusters, n_iter=100, init_size=None,
+                         random_state=None, verbose=True):
+    '''Mini-batch k-means over an iterable of sample batches, e.g.
+    iter_feature_batches; memory is bounded by the batch size.'''
+    if random_state is None:
+        random_state = np.random.RandomState()
+    batches = iter(batches)
+
+    # k-means++ seeding on the first batches
+    if init_size is None:
+        init_size = 3 * n_clusters
+    init, n_init = [], 0
+    while n_init < init_size:
+        init.append(next(batches))
+        n_init += len(init[-1])
+    centroids = kmeans_pp_init(np.vstack(init)[:init_size], n_clusters,
+                               random_state)
+
+    # number of samples seen by each centroid, its learning rate is 1 / count
+    seen = np.zeros(n_clusters)
+    for iter_ in range(n_iter):
+        batch = next(batches)
+        assignment, dist2 = WordAssigner(centroids).assign(batch, return_dist=True)
+
+        counts, sums = cluster_sums(batch, assignment, n_clusters)
+        seen += counts
+        # c <- c + (sum(x) - n * c) / seen, the per-sample gradient steps
+        # of the batch applied at once
+        hit = counts > 0
+        centroids[hit] += (sums[hit] - counts[hit, None] * centroids[hit]) / seen[hit, None]
+
+        # reseed clusters that never got a sample
+        reseed_empty(centroids, seen, batch, dist2)
+
+        if verbose:
+            print('batch {}, potential={:.3e}'.format(iter_, np.mean(dist2)))
+
+    return centroids
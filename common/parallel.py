@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+from __future__ import division
+
+import sys
+import time
+import multiprocessing
+
+
+def imap_progress(func, items, n_workers=None, chunksize=None, label='done',
+                  initializer=None, initargs=()):
+    '''Apply func to every item on a pool of n_workers processes, yielding
+    results as they complete (in any order) and printing progress and
+    throughput. func must be a module-level (picklable) function.
+
+    n_workers=None uses all the cores, n_workers=1 runs in this process.
+    initializer(*initargs) is called once in every worker (or in this
+    process), e.g. to open data shared by all the items.
+    '''
+    items = list(items)
+    n_items = len(items)
+    if n_items == 0:
+        return
+
+    if n_workers is None:
+        n_workers = multiprocessing.cpu_count()
+    if chunksize is None:
+        # a few chunks per worker keeps them busy without much IPC overhead
+        chunksize = max(1, n_items // (4 * n_workers))
+
+    if n_workers == 1:
+        pool = None
+        if initializer is not None:
+            initializer(*initargs)
+        results = (func(item) for item in items)
+    else:
+        pool = multiprocessing.Pool(n_workers, initializer, initargs)
+        results = pool.imap_unordered(func, items, chunksize)
+
+    start = time.time()
+    try:
+        for i, result in enumerate(results):
+            elapsed = time.time() - start
+            print('\r{} {}/{} ({:.1f}/s)'.format(label, i + 1, n_items,
+                                                 (i + 1) / max(elapsed, 1e-7)),
+                  end='')
+            sys.stdout.flush()
+            yield result
+        print('')
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
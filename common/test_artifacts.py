@@ -0,0 +1,37 @@
+from artifacts import ArtifactCache, digest
+import json
+import shutil
+import tempfile
+from os.path import exists, join
+
+root = join(tempfile.mkdtemp(), 'cache')
+cache = ArtifactCache(root)
+
+samples = cache.artifact('samples', {'n_samples': 1000})
+pca = cache.artifact('pca', {'dim': 32}, deps=[samples])
+vocabulary = cache.artifact('vocabulary', {'n_clusters': 100}, deps=[samples, pca])
+
+# same inputs, same key; parameter order does not matter
+assert(cache.artifact('pca', {'dim': 32}, deps=[samples]).path == pca.path)
+assert(cache.artifact('x', {'a': 1, 'b': 2}).key == cache.artifact('x', {'b': 2, 'a': 1}).key)
+
+# a changed parameter invalidates its stage and everything downstream only
+pca16 = cache.artifact('pca', {'dim': 16}, deps=[samples])
+vocabulary16 = cache.artifact('vocabulary', {'n_clusters': 100}, deps=[samples, pca16])
+assert(pca16.key != pca.key and vocabulary16.key != vocabulary.key)
+assert(cache.artifact('samples', {'n_samples': 1000}).key == samples.key)
+
+assert(not pca.exists)
+open(pca.path, 'w').close()
+assert(pca.exists and pca.path.startswith(join(root, 'pca_')))
+
+manifest = json.load(open(join(root, 'vocabulary_{}.json'.format(vocabulary.key))))
+assert(manifest['deps'] == [samples.key, pca.key])
+assert(manifest['params'] == {'n_clusters': 100})
+
+# directories (e.g. feature stores) are artifacts too
+store = cache.artifact('features', {'step': 8}, ext='')
+assert(not store.path.endswith('.dat'))
+
+assert(digest(['a.jpg', 'b.jpg']) != digest(['b.jpg', 'a.jpg']))
+shutil.rmtree(root)
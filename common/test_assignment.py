@@ -0,0 +1,27 @@
+from assignment import WordAssigner
+from scipy.spatial import distance
+import numpy as np
+
+random_state = np.random.RandomState(0)
+vocabulary = random_state.randn(50, 16)
+desc = random_state.randn(300, 16)
+dist2 = distance.cdist(desc, vocabulary, metric='sqeuclidean')
+
+# general case, blocks smaller than the number of descriptors
+assigner = WordAssigner(vocabulary, block_size=64)
+assert(not assigner.unit_words)
+words, d2 = assigner.assign(desc, return_dist=True)
+assert(np.array_equal(words, np.argmin(dist2, axis=1)))
+assert(np.allclose(d2, dist2.min(axis=1), rtol=1e-4, atol=1e-3))
+
+# unit-norm words and descriptors
+vocabulary /= np.linalg.norm(vocabulary, axis=1, keepdims=True)
+desc /= np.linalg.norm(desc, axis=1, keepdims=True)
+dist2 = distance.cdist(desc, vocabulary, metric='sqeuclidean')
+assert(WordAssigner(vocabulary).unit_words)
+words, d2 = WordAssigner(vocabulary, unit_norm=True).assign(desc, return_dist=True)
+assert(np.array_equal(words, np.argmin(dist2, axis=1)))
+assert(np.allclose(d2, dist2.min(axis=1), atol=1e-4))
+
+# single descriptor
+assert(assigner.assign(desc[0]).shape == (1,))
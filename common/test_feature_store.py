@@ -0,0 +1,76 @@
+from feature_store import FeatureStore, extract_features, iter_feature_batches
+import numpy as np
+import shutil
+import tempfile
+from os.path import join
+
+path = join(tempfile.mkdtemp(), 'features')
+random_state = np.random.RandomState(0)
+desc1, kp1 = random_state.rand(5, 8), random_state.rand(5, 4)
+desc2, kp2 = random_state.rand(3, 8), random_state.rand(3, 4)
+
+store = FeatureStore(path, ndim=8)
+store.append('a.jpg', desc1, kp1)
+store.append('b/c.jpg', desc2, kp2)
+store.append('empty.jpg', np.zeros((0, 8)), np.zeros((0, 4)))
+assert(len(store) == 3 and 'a.jpg' in store and 'x.jpg' not in store)
+
+# reopen: metadata comes from disk
+store = FeatureStore(path)
+assert(store.ndim == 8)
+fdict = store.get('b/c.jpg')
+assert(np.allclose(fdict['desc'], desc2) and np.allclose(fdict['kp'], kp2))
+assert(store.get('empty.jpg')['desc'].shape == (0, 8))
+
+# an interrupted append (data without table entry) is discarded
+with open(join(path, 'desc.bin'), 'ab') as fh:
+    fh.write(b'garbage')
+store = FeatureStore(path)
+store.append('d.jpg', desc1)
+assert(np.allclose(store.get('d.jpg')['desc'], desc1))
+assert(np.allclose(store.get('a.jpg')['desc'], desc1))
+
+# descriptors only
+store2 = FeatureStore(join(path, 'nokp'), ndim=8, kp_dim=0)
+store2.append('a.jpg', desc1)
+assert(store2.get('a.jpg')['kp'].shape == (5, 0))
+
+
+# compact keypoints: only xy, as float16
+store4 = FeatureStore(join(path, 'xy16'), ndim=8, kp_dim=2, kp_dtype=np.float16)
+store4.append('a.jpg', desc1, kp1[:, :2] * 640)
+store4 = FeatureStore(join(path, 'xy16'))
+assert(store4.kp_dtype == np.float16 and store4.get('a.jpg')['kp'].dtype == np.float16)
+assert(np.allclose(store4.get('a.jpg')['kp'], kp1[:, :2] * 640, atol=0.5))
+
+# stores written before kp_dtype was recorded have float32 keypoints
+with open(join(path, 'meta.txt'), 'w') as fh:
+    fh.write('8 4 float32\n')
+assert(FeatureStore(path).kp_dtype == np.float32)
+assert(np.allclose(FeatureStore(path).get('b/c.jpg')['kp'], kp2))
+
+
+# extraction into a store, skipping the images already there
+def fake_extract(job):
+    fname, imfile = job
+    return fname, np.full((len(fname), 8), len(imfile), dtype=np.float32), None
+
+
+store3 = extract_features(fake_extract, 'base', ['x.jpg', 'yy.jpg'], join(path, 'ex'),
+                          n_workers=1, kp_dim=0)
+assert(len(store3) == 2 and store3.get('yy.jpg')['desc'].shape == (6, 8))
+store3 = extract_features(fake_extract, 'base', ['x.jpg', 'yy.jpg', 'z.jpg'],
+                          join(path, 'ex'), n_workers=2, kp_dim=0)
+assert(store3.names == ['x.jpg', 'yy.jpg', 'z.jpg'])
+assert(np.all(store3.get('z.jpg')['desc'] == len(join('base', 'z.jpg'))))
+
+
+# endless stream of fixed-size batches of descriptors of random images
+from itertools import islice
+batches = list(islice(iter_feature_batches(store, ['a.jpg', 'b/c.jpg', 'empty.jpg'], 4,
+                                           n_per_file=2, random_state=random_state), 10))
+assert(all(b.shape == (4, 8) for b in batches))
+rows = set(map(tuple, np.vstack((desc1, desc2)).astype(np.float32)))
+assert(all(tuple(row) in rows for b in batches for row in b))
+
+shutil.rmtree(path)
@@ -0,0 +1,27 @@
+from kernel_maps import kernel_map, additive_kernel, chi2, KERNELS
+import numpy as np
+
+np.seterr(all='raise')
+random_state = np.random.RandomState(0)
+
+# sparse, L1-normalized histograms, as BoVWs
+X = random_state.rand(20, 50) * (random_state.rand(20, 50) > 0.5)
+X /= X.sum(axis=1, keepdims=True)
+Y = random_state.rand(10, 50) * (random_state.rand(10, 50) > 0.5)
+Y /= Y.sum(axis=1, keepdims=True)
+
+assert(np.allclose(additive_kernel(X, Y, 'intersection'),
+                   [[np.minimum(x, y).sum() for y in Y] for x in X]))
+assert(np.allclose(chi2(np.array([0., 1., 2.]), np.array([0., 1., 0.])), [0., 1., 0.]))
+
+# mapped dot-products approximate the kernels (exactly for Hellinger)
+for kernel in KERNELS:
+    psi_x, psi_y = kernel_map(X, kernel), kernel_map(Y, kernel)
+    K = additive_kernel(X, Y, kernel)
+    err = np.abs(np.dot(psi_x, psi_y.T) - K).max() / K.max()
+    assert(err < {'hellinger': 1e-5, 'chi2': 0.02, 'intersection': 0.08}[kernel])
+
+assert(kernel_map(X, 'chi2', order=3).shape == (20, 50 * 7))
+assert(kernel_map(X, 'hellinger').shape == (20, 50))
+# empty bins map to zeros
+assert(np.all(kernel_map(np.zeros((1, 4)), 'intersection') == 0))
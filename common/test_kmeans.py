@@ -0,0 +1,36 @@
+from kmeans import kmeans_fit, minibatch_kmeans_fit, cluster_sums
+import numpy as np
+
+random_state = np.random.RandomState(0)
+
+# well separated blobs
+centers = 20 * random_state.randn(10, 8)
+labels = random_state.randint(0, 10, 2000)
+samples = centers[labels] + random_state.randn(2000, 8)
+
+
+def matched(centroids, tol=1.):
+    # every true center has a centroid close to it
+    dist2 = np.sum((centers[:, None, :] - centroids[None]) ** 2, axis=2)
+    return np.all(dist2.min(axis=1) < tol)
+
+
+counts, sums = cluster_sums(samples, labels, 12)
+assert(counts[10:].sum() == 0 and np.allclose(sums[3], samples[labels == 3].sum(0)))
+
+assert(matched(kmeans_fit(samples, 10, random_state=random_state, verbose=False)))
+
+# empty clusters are reseeded: more clusters than distinct samples
+dup = np.repeat(samples[:5], 20, axis=0)
+centroids = kmeans_fit(dup, 8, init='random', random_state=random_state, verbose=False)
+assert(centroids.shape == (8, 8) and np.all(np.isfinite(centroids)))
+
+
+def batches():
+    while True:
+        yield samples[random_state.randint(0, len(samples), 200)]
+
+
+# noisier, the centroids move with the last batches
+assert(matched(minibatch_kmeans_fit(batches(), 10, n_iter=50,
+                                    random_state=random_state, verbose=False), tol=4.))
@@ -0,0 +1,23 @@
+from vocab_tree import VocabularyTree
+import numpy as np
+
+random_state = np.random.RandomState(0)
+
+# 2 x 2 x 2 hierarchy of well separated blobs
+centers = (1000 * random_state.randn(2, 1, 1, 8) +
+           100 * random_state.randn(2, 2, 1, 8) +
+           10 * random_state.randn(2, 2, 2, 8)).reshape(8, 1, 8)
+samples = (centers + random_state.randn(8, 50, 8)).reshape(-1, 8)
+
+tree = VocabularyTree(branch_factor=2, depth=3)
+tree.fit(samples, random_state=random_state, verbose=False)
+assert(tree.n_words == 8)
+assert(tree.words.shape == (8, 8))
+
+# every blob maps to its own leaf
+words = tree.assign(samples).reshape(8, 50)
+assert(np.all(words == words[:, :1]))
+assert(len(np.unique(words)) == 8)
+
+# single descriptor
+assert(tree.assign(samples[0]).shape == (1,))
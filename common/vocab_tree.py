@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+'''Hierarchical k-means vocabulary tree.
+
+Nister, D., & Stewenius, H. (2006). Scalable recognition with a vocabulary
+tree. In: CVPR.
+
+A tree with branch factor k and depth L has k**L leaves (visual words).
+Assigning a descriptor costs k * L distance computations instead of k**L.
+'''
+from __future__ import print_function
+from __future__ import division
+
+import sys
+
+import numpy as np
+
+from dtypes import FLOAT, as_float
+from kmeans import kmeans_fit
+
+
+def _kmeans(samples, k, n_iter=20, random_state=None):
+    # nodes with less than k samples get duplicated centroids, so that every
+    # node has exactly k children
+    n_samples = samples.shape[0]
+    if n_samples <= k:
+        return samples[np.arange(k) % n_samples].astype(FLOAT)
+    return kmeans_fit(samples, k, maxiter=n_iter, random_state=random_state,
+                      verbose=False)
+
+
+class VocabularyTree(object):
+    '''Vocabulary tree with `branch_factor` children per node and `depth`
+    levels; centers[l] holds the centroids of the branch_factor**(l + 1)
+    nodes of level l, children of node j being rows j*k to (j+1)*k - 1.'''
+
+    def __init__(self, branch_factor=10, depth=3):
+        self.branch_factor = branch_factor
+        self.depth = depth
+        self.centers = []
+
+    @property
+    def n_words(self):
+        return self.branch_factor ** self.depth
+
+    @property
+    def words(self):
+        '''Leaf centroids, i.e. the equivalent flat vocabulary.'''
+        return self.centers[-1]
+
+    def fit(self, samples, n_iter=20, random_state=None, verbose=True):
+        if random_state is None:
+            random_state = np.random.RandomState()
+
+        k = self.branch_factor
+        samples = as_float(samples)
+        node = np.zeros(len(samples), dtype=np.int64)
+
+        self.centers = []
+        for level in range(self.depth):
+            n_nodes = k ** level
+            centers = np.zeros((n_nodes * k, samples.shape[1]), dtype=FLOAT)
+
+            # samples grouped by their node at the current level
+            order = np.argsort(node, kind='mergesort')
+            bounds = np.concatenate(([0], np.cumsum(np.bincount(node, minlength=n_nodes))))
+            for j in range(n_nodes):
+                members = samples[order[bounds[j]:bounds[j + 1]]]
+                if len(members) == 0:
+                    # empty node: children collapse onto the parent centroid
+                    centers[j * k:(j + 1) * k] = self.centers[-1][j]
+                    continue
+                centers[j * k:(j + 1) * k] = _kmeans(members, k, n_iter,
+                                                     random_state)
+                if verbose:
+                    print('\rlevel {}: node {}/{}'.format(level + 1, j + 1,
+                                                           n_nodes), end='')
+                    sys.stdout.flush()
+            if verbose:
+                print('')
+
+            self.centers.append(centers)
+            node = self._descend(samples, node, centers)
+
+        return self
+
+    def _descend(self, desc, node, centers, block_size=4096):
+        # pick the closest among the k children of each descriptor's node,
+        # in blocks to bound the size of the gathered (n, k, ndim) centroids
+        k = self.branch_factor
+        child = np.zeros_like(node)
+        for start in range(0, len(desc), block_size):
+            block = slice(start, start + block_size)
+            children = node[block, None] * k + np.arange(k)
+            c = centers[children]
+            dist2 = (np.einsum('nkd,nkd->nk', c, c) -
+                     2 * np.einsum('nd,nkd->nk', desc[block], c))
+            child[block] = children[np.arange(len(children)),
+                                    np.argmin(dist2, axis=1)]
+        return child
+
+    def assign(self, desc):
+        '''Leaf (visual word) index of every descriptor.'''
+        desc = np.atleast_2d(as_float(desc))
+        node = np.zeros(len(desc), dtype=np.int64)
+        for centers in self.centers:
+            node = self._descend(desc, node, centers)
+        return node
+
+    def save(self, filename):
+        with open(filename, 'wb') as fh:
+            np.savez(fh, branch_factor=self.branch_factor, depth=self.depth,
+                     *self.centers)
+
+    @classmethod
+    def load(cls, filename):
+        with open(filename, 'rb') as fh:
+            data = np.load(fh)
+            tree = cls(int(data['branch_factor']), int(data['depth']))
+            tree.centers = [data['arr_{:d}'.format(l)] for l in range(tree.depth)]
+        return tree
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+from __future__ import division
+
+from multiprocessing.pool import ThreadPool
+
+import numpy as np
+
+
+def _intersection_block(X, Y, max_cells):
+    # sum_k min(x_k, y_k) for all the (x, y) pairs, broadcasting row blocks of
+    # X so that the (rows x len(Y) x ndim) temporary has at most max_cells
+    K = np.empty((len(X), len(Y)), dtype=np.result_type(X, Y))
+    rows = max(1, max_cells // max(1, Y.size))
+    for start in range(0, len(X), rows):
+        block = X[start:start + rows]
+        K[start:start + rows] = np.minimum(block[:, None, :], Y[None, :, :]).sum(axis=2)
+    return K
+
+
+def intersection_kernel(X, Y=None, n_workers=1, block_rows=64, max_cells=2**24):
+    '''Histogram intersection Gram matrix K[i, j] = sum_k min(X[i, k], Y[j, k]).
+
+    Blocks of block_rows rows of X are computed in parallel by n_workers
+    threads (the element-wise NumPy loops release the GIL). With Y=None, the
+    symmetric training Gram matrix of X is returned.
+    '''
+    X = np.ascontiguousarray(X)
+    Y = X if Y is None else np.ascontiguousarray(Y)
+    starts = range(0, len(X), block_rows)
+
+    def job(start):
+        return _intersection_block(X[start:start + block_rows], Y, max_cells)
+
+    if n_workers > 1:
+        pool = ThreadPool(n_workers)
+        blocks = pool.map(job, starts)
+        pool.close()
+        pool.join()
+    else:
+        blocks = [job(start) for start in starts]
+    if not blocks:
+        return np.zeros((0, len(Y)), dtype=np.result_type(X, Y))
+    return np.concatenate(blocks, axis=0)
@@ -1,12 +1,17 @@
 """Train a sequence tagger.
 
 Usage:
-  lab1.py [-c <integer>] [-t <integer>] [-k <kernel>]
+  lab1.py [-c <integer>] [-t <integer>] [-k <kernel>] [-d <integer>] [-m <integer>] [-s <integer>]
 
 Options:
-  -c <integer>    Number of clusters
-  -t <integer>    Number of threads
-  -k <string>     one of 'intersect' or 'rbf'
+  -c <integer>    Number of clusters (branch factor when using -d)
+  -t <integer>    Number of worker processes
+  -k <string>     one of 'intersect', 'rbf' or 'linear', or a linear SVM on the
+                  explicit map of an additive kernel: 'intersect-map',
+                  'chi2-map' or 'hellinger-map'
+  -d <integer>    Depth of a vocabulary tree with c**d words (flat if omitted)
+  -m <integer>    Mini-batch size for streaming k-means (full batch if omitted)
+  -s <integer>    Seed of the train/test split [default: 12345]
 """
 
 
@@ -30,11 +35,22 @@ from skimage.transform import rescale
 
 from sklearn.svm import LinearSVC, SVC
 
-from scipy.spatial import distance
 from scipy.io import savemat, loadmat
 from docopt import docopt
 from datetime import datetime
 
+sys.path.append(join(split(abspath(__file__))[0], '..', 'common'))
+from vocab_tree import VocabularyTree
+from assignment import WordAssigner
+from kmeans import kmeans_fit, minibatch_kmeans_fit
+from feature_store import extract_features, iter_feature_batches
+from dtypes import FLOAT
+from artifacts import ArtifactCache, digest
+
+from kernels import intersection_kernel
+from kernel_maps import kernel_map
+from model_selection import CrossValidation, coarse_to_fine, successive_halving
+
 def save_data(data, filename, force_overwrite=False):
     # if dir/subdir doesn't exist, create it
     dirname = split(filename)[0]
@@ -52,7 +68,7 @@ def load_scene_categories(path, random_state=None):
     cid = []                       # class id wrt cname list
     fname = []                     # relative file paths
     for i, cls in enumerate(cname):
-        for img in listdir(join(path, cls)):
+        for img in sorted(listdir(join(path, cls))):
             if splitext(img)[1] not in ('.jpeg', '.jpg', '.png'):
                 continue
             fname.append(join(cls, img))
@@ -104,41 +120,27 @@ def extract_multiscale_dense_features(imfile, step=8, scales=SCALES_3):
         for f in feat:
             np.sqrt(f, f)
         feat_all.append(feat)
-    return np.row_stack(feat_all).astype(np.float32)
+    return np.row_stack(feat_all).astype(FLOAT)
 
 
-def compute_features(base_path, im_list, output_path):
-    # compute and store low level features for all images
-    for fname in im_list:
-        # image full path
-        imfile = join(base_path, fname)
-
-        # check if destination file already exists
-        featfile = join(output_path, splitext(fname)[0] + '.feat')
-        if exists(featfile):
-            print('{} already exists'.format(featfile))
-            continue
+def extract_job(job):
+    fname, imfile = job
+    return fname, extract_multiscale_dense_features(imfile), None
 
-        feat = extract_multiscale_dense_features(imfile)
-        save_data(feat, featfile)
-        print('{}: {} features'.format(featfile, feat.shape[0]))
 
-
-def sample_feature_set(base_path, im_list, output_path, n_samples,
+def sample_feature_set(store, im_list, sample_file, n_samples,
                        random_state=None):
     if random_state is None:
         random_state = np.random.RandomState()
 
     n_per_file = 100
-    sample_file = join(output_path, 'sample{:d}.feat'.format(n_samples))
     if exists(sample_file):
         sample = load_data(sample_file)
     else:
         sample = []
         while len(sample) < n_samples:
             i = random_state.randint(0, len(im_list))
-            featfile = join(base_path, splitext(im_list[i])[0] + '.feat')
-            feat = load_data(featfile)
+            feat = store.get(im_list[i])['desc']
             idxs = random_state.choice(range(feat.shape[0]), 100)
             sample += [feat[i] for i in idxs]
             print('\r{}/{} samples'.format(len(sample), n_samples), end='')
@@ -150,60 +152,38 @@ def sample_feature_set(base_path, im_list, output_path, n_samples,
     return sample
 
 
-def kmeans_fit(samples, n_clusters, maxiter=100, tol=1e-4, random_state=None):
-    if random_state is None:
-        random_state = np.random.RandomState()
-
-    n_samples = samples.shape[0]
-
-    # chose random samples as initial estimates
-    idxs = random_state.randint(0, n_samples, n_clusters)
-    centroids = samples[idxs, :]
-
-    J_old = np.inf
-    for iter_ in range(maxiter):
-
-        # SAMPLE-TO-CLUSTER ASSIGNMENT
-
-        # cdist returns a matrix of size n_samples x n_clusters, where the i-th
-        # row stores the (squared) distance from sample i to all centroids
-        dist2 = distance.cdist(samples, centroids, metric='sqeuclidean')
-
-        # argmin over columns of the distance matrix
-        assignment = np.argmin(dist2, axis=1)
-
-        # CENTROIDS UPDATE (+ EVAL DISTORTION)
+def encode_bovw(vocabulary, features, norm=2, block_rows=2**16):
+    # (n_images x n_words) matrix of square-rooted, L1/L2 normalized BoVWs.
+    # The descriptors of consecutive images are assigned together, about
+    # block_rows at a time (a single GEMM + argmax with a WordAssigner, see
+    # assignment.py), and counted with one bincount of image * n_words + word
+    if not isinstance(vocabulary, (VocabularyTree, WordAssigner)):
+        vocabulary = WordAssigner(vocabulary)
+    n_words = vocabulary.n_words
+    n_images = len(features)
+    bovw = np.zeros((n_images, n_words), dtype=FLOAT)
+
+    start = 0
+    while start < n_images:
+        stop, n_rows = start + 1, len(features[start])
+        while stop < n_images and n_rows + len(features[stop]) <= block_rows:
+            n_rows += len(features[stop])
+            stop += 1
+        block = [np.atleast_2d(f) for f in features[start:stop]]
+        desc = np.concatenate(block)
+        if isinstance(vocabulary, WordAssigner) and vocabulary.ndim != desc.shape[1]:
+            raise RuntimeError('something is wrong with the data dimensionality')
+        words = vocabulary.assign(desc) if len(desc) > 0 else np.zeros(0, dtype=np.int64)
+        image = np.repeat(np.arange(stop - start), [len(f) for f in block])
+        counts = np.bincount(image * n_words + words, minlength=(stop - start) * n_words)
+        bovw[start:stop] = counts.reshape(stop - start, n_words)
+        start = stop
+
+    np.sqrt(bovw, out=bovw)
+    nrm = np.linalg.norm(bovw, ord=norm, axis=1)
+    bovw /= (nrm + 1e-7)[:, None]
+    return bovw
 
-        J_new = 0.
-        for k in range(n_clusters):
-            idxs = np.where(assignment == k)[0]
-            if len(idxs) == 0:
-                raise RuntimeError('k-means crash!')
-
-            centroids[k, :] = np.mean(samples[idxs], axis=0).astype(np.float32)
-
-            J_new += np.sum(dist2[idxs, assignment[idxs]])
-        J_new /= float(n_samples)
-
-        print('iteration {}, potential={:.3e}'.format(iter_, J_new))
-        if (J_old - J_new) / J_new < tol:
-            print('STOP')
-            break
-        J_old = J_new
-
-    return centroids
-
-
-def compute_bovw(vocabulary, features, norm=2):
-    if vocabulary.shape[1] != features.shape[1]:
-        raise RuntimeError('something is wrong with the data dimensionality')
-    # dist2 = 2 * (1 - np.dot(features, vocabulary.transpose()))
-    dist2 = distance.cdist(features, vocabulary, metric='sqeuclidean')
-    assignments = np.argmin(dist2, axis=1)
-    bovw, _ = np.histogram(assignments, range(vocabulary.shape[1]))
-    bovw = np.sqrt(bovw)
-    nrm = np.linalg.norm(bovw, ord=norm)
-    return bovw / (nrm + 1e-7)
 
 '''
 updates a list on disk with the provided element, if the file is present
@@ -223,86 +203,36 @@ def appendToList(filename, element):
     return items
 
 
-def call_bow(fname):
-    # low-level features file
-    featfile = join(output_path, splitext(fname)[0] + '.feat')
-    bovwfile = join(output_path, splitext(fname)[0] + '.bovw')
-
-    # check if destination file already exists
-    if exists(bovwfile):
-        print('{} already exists'.format(bovwfile))
-        return
-
-    #feat = pickle.load(open(featfile, 'rb'))
-    features = load_data(featfile)
-    bovw = compute_bovw(vocabulary, features, 2)
-    save_data(bovw, bovwfile)
-    print('{}'.format(bovwfile))
-
-
-def search_top_c(param):
-    c_candidates = np.arange(2, 4, .2)
-    topC, topAcc = 1.6, 0.0
-
-    if param == 'linear' or param == 'intersect':
-        for candidate in c_candidates:
-            splits = 5
-            # map from a split number -> accuracy of that split
-            split_acc = {}
-            for split in range(splits):
-                if param == 'linear':
-                    svm = LinearSVC(C=candidate, verbose=1)
-                else:
-                    svm = SVC(C=candidate, verbose=1, kernel=int_kernel)
-
-                chunk_size = int(len(X_train) / float(splits))
-                start = split * chunk_size
-                stop = (split + 1) * chunk_size if split is not (splits - 1) else len(X_train)
-                x = np.concatenate((X_train[:start], X_train[stop:]))
-                y = np.concatenate((y_train[:start], y_train[stop:]))
-                svm.fit(x, y)
-                y_pred = svm.predict(X_train[start:stop])
-                split_acc[split] = sum(y_pred == y_train[start:stop]) / len(y_train[start:stop])
-
-            # compute accuracy for current C
-            curr_acc = np.mean(list(split_acc.values()))
-            if curr_acc > topAcc:
-                topAcc = curr_acc
-                topC = candidate
-        return topC, topAcc, 0
-
-    if param == 'rbf':
-        c_candidates = np.arange(3, 7, .2)
-        topGamma = 0
-        import itertools
-        gamma_candidates = np.arange(2, 6, .2)
-        for C, gamma in itertools.product(c_candidates, gamma_candidates):
-            splits = 5
-            # map from a split number -> accuracy of that split
-            split_acc = {}
-            for split in range(splits):
-                svm = SVC(C=C, kernel='rbf', gamma=gamma, verbose=1)
-
-                chunk_size = int(len(X_train) / float(splits))
-                start = split * chunk_size
-                stop = (split + 1) * chunk_size if split is not (splits - 1) else len(X_train)
-                x = np.concatenate((X_train[:start], X_train[stop:]))
-                y = np.concatenate((y_train[:start], y_train[stop:]))
-                svm.fit(x, y)
-                y_pred = svm.predict(X_train[start:stop])
-                split_acc[split] = sum(y_pred == y_train[start:stop]) / len(y_train[start:stop])
-
-            # compute accuracy for current C
-            curr_acc = np.mean(list(split_acc.values()))
-            if curr_acc > topAcc:
-                topAcc = curr_acc
-                topC = C
-                topGamma = gamma
-        return topC, topAcc, topGamma
+def search_top_c(param, X, y, n_workers=1, results_file=None):
+    '''Cross-validated C (and gamma for rbf) of the SVM; with
+    param='intersect', X is the precomputed training Gram matrix.'''
+    kernel = 'precomputed' if param == 'intersect' else param
+    cv = CrossValidation(X, y, kernel, n_splits=5, n_workers=n_workers,
+                         results_file=results_file)
+    try:
+        if param == 'linear':
+            # the whole C range by successive halving, its first rung (one
+            # fold per C) is the screening
+            candidates = [{'C': C} for C in np.arange(2, 4, .2)]
+            scores = successive_halving(candidates, cv.scores)
+            best = int(np.argmax(scores))
+            top, topAcc = candidates[best], scores[best]
+        else:
+            if param == 'rbf':
+                grid = {'C': np.arange(3, 7, .2), 'gamma': np.arange(2, 6, .2)}
+            else:
+                grid = {'C': np.arange(2, 4, .2)}
+            top, topAcc = coarse_to_fine(grid, lambda c: successive_halving(c, cv.scores))
+    finally:
+        cv.close()
+    return top['C'], topAcc, top.get('gamma', 0)
+
 
 if __name__ == "__main__":
+    # seed of the dictionary learning stages, the split has its own (-s)
     random_state = np.random.RandomState(12345)
     opts = docopt(__doc__)
+    split_seed = int(opts['-s'])
     print(opts['-k'])
 
     # ----------------
@@ -312,6 +242,9 @@ if __name__ == "__main__":
     # paths
     dataset_path = abspath('scene_categories')
     output_path = 'cache'
+    # artifacts are named after a hash of their parameters and inputs, so a
+    # parameter sweep only recomputes the stages that depend on the parameter
+    cache = ArtifactCache(output_path)
 
     # load dataset, a dictionary with keys {cid, cname, fname : [path_to_file]}
     dataset = load_scene_categories(dataset_path)
@@ -321,13 +254,20 @@ if __name__ == "__main__":
 
     # train-test split
     # train_set and test_set are lists of tuples [(path_to_file, category_number)]
-    train_set, test_set = n_per_class_split(dataset, n=100)
+    # (seeded by -s: run_p1.sh averages the test accuracy over many splits)
+    train_set, test_set = n_per_class_split(dataset, n=100,
+                                            random_state=np.random.RandomState(split_seed))
     n_train = len(train_set)
     n_test = len(test_set)
     print('{} training samples / {} testing samples'.format(n_train, n_test))
 
     # compute and store low level features for all images
-    compute_features(dataset_path, dataset['fname'], output_path)
+    n_workers = int(opts['-t']) if opts['-t'] else 1
+    features_artifact = cache.artifact('features', {'descriptor': 'DAISY', 'step': 8,
+                                                    'scales': SCALES_3, 'dtype': FLOAT.name},
+                                       ext='')
+    feature_store = extract_features(extract_job, dataset_path, dataset['fname'],
+                                     features_artifact.path, n_workers, kp_dim=0)
 
     # --------------------------------
     # UNSUPERVISED DICTIONARY LEARNING
@@ -335,13 +275,44 @@ if __name__ == "__main__":
 
     n_samples = int(1e5)
     n_clusters = int(opts.get('-c', 100)) if opts['-c'] else 100
-    vocabulary_file = join(output_path, 'vocabulary{:d}.dat'.format(n_clusters))
-    if exists(vocabulary_file):
+    tree_depth = int(opts['-d']) if opts['-d'] else 0
+    train_files = [fname for (fname, cid) in train_set]
+    # the dictionary is learned once, from the training images of the
+    # default split, and shared by the runs on other splits (the split only
+    # changes the SVM stages, as with the sample and vocabulary files of the
+    # original exercise)
+    vocab_files = [fname for (fname, cid) in
+                   n_per_class_split(dataset, n=100, random_state=np.random.RandomState(12345))[0]]
+    sample_artifact = cache.artifact('sample', {'n_samples': n_samples, 'seed': 12345,
+                                                'train': digest(vocab_files)},
+                                     deps=[features_artifact])
+    vocabulary_params = {'n_clusters': n_clusters, 'tree_depth': tree_depth,
+                         'minibatch': opts['-m'] and int(opts['-m'])}
+    vocabulary_artifact = cache.artifact('vocabulary', vocabulary_params,
+                                         deps=[sample_artifact])
+    vocabulary_file = vocabulary_artifact.path
+    if tree_depth > 0 and exists(vocabulary_file):
+        vocabulary = VocabularyTree.load(vocabulary_file)
+    elif tree_depth > 0:
+        sample = sample_feature_set(feature_store, vocab_files, sample_artifact.path,
+                                    n_samples, random_state=random_state)
+        vocabulary = VocabularyTree(n_clusters, tree_depth)
+        vocabulary.fit(sample, random_state=random_state)
+        vocabulary.save(vocabulary_file)
+    elif exists(vocabulary_file):
         #vocabulary = pickle.load(open(vocabulary_file, 'rb'))
         vocabulary = load_data(vocabulary_file)
+    elif opts['-m']:
+        # stream batches straight from the feature files
+        batch_size = int(opts['-m'])
+        batches = iter_feature_batches(feature_store, vocab_files, batch_size,
+                                       random_state=random_state)
+        vocabulary = minibatch_kmeans_fit(batches, n_clusters,
+                                          n_iter=max(100, 10 * n_samples // batch_size),
+                                          random_state=random_state)
+        save_data(vocabulary, vocabulary_file)
     else:
-        train_files = [fname for (fname, cid) in train_set]
-        sample = sample_feature_set(output_path, train_files, output_path,
+        sample = sample_feature_set(feature_store, vocab_files, sample_artifact.path,
                                     n_samples, random_state=random_state)
         vocabulary = kmeans_fit(sample, n_clusters=n_clusters,
                                 random_state=random_state)
@@ -350,21 +321,28 @@ if __name__ == "__main__":
         #    word/=(np.linalg.norm(word, ord=2) + 1e-7)
         save_data(vocabulary, vocabulary_file)
 
-    print('{}: {} clusters'.format(vocabulary_file, vocabulary.shape[0]))
+    if tree_depth > 0:
+        print('{}: {} words'.format(vocabulary_file, vocabulary.n_words))
+    else:
+        print('{}: {} clusters'.format(vocabulary_file, vocabulary.shape[0]))
+        # word norms are computed once and shared by all the BoVW blocks
+        vocabulary = WordAssigner(vocabulary)
 
     # --------------------
     # COMPUTE BoVW VECTORS
     # --------------------
+    # all the images in one (n_images x n_words) matrix, rows in dataset order
+    bovw_artifact = cache.artifact('bovw', deps=[features_artifact, vocabulary_artifact])
+    bovw_file = bovw_artifact.path
     start = datetime.now()
-    if opts['-t']:
-        n_threads = int(opts.get('-t'))
-        import multiprocessing
-        pool = multiprocessing.Pool(4)
-        pool.map(call_bow, dataset['fname'], 4400 // n_threads)
+    if exists(bovw_file):
+        bovw = load_data(bovw_file).reshape(n_images, -1)
     else:
-        # serial version
-        for fname in dataset['fname']:
-            call_bow(fname)
+        bovw = encode_bovw(vocabulary, [feature_store.get(fname)['desc']
+                                        for fname in dataset['fname']], norm=2)
+        save_data(bovw, bovw_file)
+    print('{}: {} BoVWs'.format(bovw_file, len(bovw)))
+    bovw_row = dict((fname, i) for i, fname in enumerate(dataset['fname']))
 
     # store times
     appendToList('bowt.pk', (datetime.now() - start).total_seconds())
@@ -375,50 +353,54 @@ if __name__ == "__main__":
     # -----------------
 
     # setup training data
-    X_train, y_train = [], []
-    for fname, cid in train_set:
-        bovwfile = join(output_path, splitext(fname)[0] + '.bovw')
-        #X_train.append(pickle.load(open(bovwfile, 'rb')))
-        X_train.append(load_data(bovwfile))
-        y_train.append(cid)
-    X_train = np.array(X_train)
-    y_train = np.array(y_train)
+    X_train = bovw[[bovw_row[fname] for fname, _ in train_set]]
+    y_train = np.array([cid for _, cid in train_set])
 
+    # intersection kernel between all the training BoVWs
+    if opts['-k'] == 'intersect':
+        K_train = intersection_kernel(X_train, n_workers=n_workers)
 
-    def metric(X, Y):
-        return np.sum(np.minimum(X, Y))
-
-    def int_kernel(X,Y):
-        return distance.cdist(X, Y, metric=metric)
+    # additive kernels through explicit feature maps: linear SVMs on the
+    # mapped BoVWs, training and testing cost linear in the number of images
+    kernel_maps = {'intersect-map': 'intersection', 'chi2-map': 'chi2',
+                   'hellinger-map': 'hellinger'}
+    mapped_kernel = kernel_maps.get(opts['-k'])
+    if mapped_kernel is not None:
+        X_train = kernel_map(X_train, mapped_kernel)
 
     # ----------------------
     # Find top parameter C
     # ----------------------
 
-    topC, topAcc, topGamma = search_top_c(opts['-k'])
+    # fold accuracies are kept on disk, an interrupted search resumes
+    cv_file = cache.artifact('cv', {'kernel': opts['-k'], 'n_splits': 5,
+                                    'train': digest(train_files)},
+                             deps=[bovw_artifact], ext='.jsonl').path
+    param = 'linear' if mapped_kernel or not opts['-k'] else opts['-k']
+    topC, topAcc, topGamma = search_top_c(param, K_train if param == 'intersect' else X_train,
+                                          y_train, n_workers, cv_file)
 
     print('\ntop accuracy = {:.3f}'.format(topAcc))
     print('with C = {:.3f}'.format(topC))
 
     # setup testing data
-    X_test, y_test = [], []
-    for fname, cid in test_set:
-        bovwfile = join(output_path, splitext(fname)[0] + '.bovw')
-        #X_test.append(pickle.load(open(bovwfile, 'rb')))
-        X_test.append(load_data(bovwfile))
-        y_test.append(cid)
-    X_test = np.array(X_test)
-    y_test = np.array(y_test)
+    X_test = bovw[[bovw_row[fname] for fname, _ in test_set]]
+    y_test = np.array([cid for _, cid in test_set])
+    if mapped_kernel is not None:
+        X_test = kernel_map(X_test, mapped_kernel)
 
     if opts['-k'] == 'intersect':
-        svm = SVC(C=topC, verbose=1, kernel=int_kernel)
-    elif opts['-k'] == 'rbf':
-        svm = SVC(C=topC, verbose=1, gamma=topGamma)
+        svm = SVC(C=topC, verbose=1, kernel='precomputed')
+        svm.fit(K_train, y_train)
+        # test rows of the kernel, blocks computed in parallel
+        y_pred = svm.predict(intersection_kernel(X_test, X_train, n_workers=n_workers))
     else:
-        svm = LinearSVC(C=topC, verbose=0)
-
-    svm.fit(X_train, y_train)
-    y_pred = svm.predict(X_test)
+        if opts['-k'] == 'rbf':
+            svm = SVC(C=topC, verbose=1, gamma=topGamma)
+        else:
+            svm = LinearSVC(C=topC, verbose=0)
+        svm.fit(X_train, y_train)
+        y_pred = svm.predict(X_test)
 
     tp = np.sum(y_test == y_pred)
     acc = float(tp) / len(y_test)
@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+'''Cross-validated grid search of SVM parameters.
+
+Every (parameters, fold) pair is an independent job run on a process pool.
+The training matrix (the BoVWs, or the Gram matrix of a precomputed kernel)
+is written once to a .npy file that the workers open as a read-only memmap,
+so it is not pickled for every job. The accuracy of every finished fold is
+appended to a results file, and a sweep that is interrupted and started
+again only runs the missing folds.
+
+Instead of the whole dense grid, coarse_to_fine() evaluates every stride-th
+grid point and then halves the stride around the best point so far.
+
+successive_halving() (Jamieson & Talwalkar, 2016) spends little on bad
+candidates: all of them are scored on one fold, the best 1/eta on eta folds,
+and so on up to the full cross-validation. Fold results are cached, so a
+promoted candidate only trains on its new folds.
+'''
+from __future__ import print_function
+from __future__ import division
+
+import itertools
+import json
+import shutil
+import sys
+import tempfile
+from os.path import join, split, abspath, exists
+
+import numpy as np
+
+from sklearn.svm import LinearSVC, SVC
+
+sys.path.append(join(split(abspath(__file__))[0], '..', 'common'))
+from parallel import imap_progress
+
+
+def fold_bounds(n, n_splits=5):
+    '''(start, stop) of the n_splits contiguous folds of n samples, the last
+    one taking the remainder.'''
+    chunk_size = n // n_splits
+    return [(i * chunk_size, (i + 1) * chunk_size if i < n_splits - 1 else n)
+            for i in range(n_splits)]
+
+
+def make_svm(kernel, C, gamma=None):
+    if kernel == 'linear':
+        return LinearSVC(C=C)
+    if kernel == 'rbf':
+        return SVC(C=C, kernel='rbf', gamma=gamma)
+    if kernel == 'precomputed':
+        return SVC(C=C, kernel='precomputed')
+    raise ValueError('unknown kernel: {}'.format(kernel))
+
+
+# data shared by the jobs of a worker, opened once by _open_shared()
+_shared = {}
+
+
+def _open_shared(X_file, y_file):
+    _shared['X'] = np.load(X_file, mmap_mode='r')
+    _shared['y'] = np.load(y_file)
+
+
+def fold_accuracy(kernel, params, start, stop, X, y):
+    '''Accuracy on samples [start, stop) of the SVM trained on the others.
+    With kernel='precomputed', X is the (n x n) training Gram matrix.'''
+    train = np.r_[0:start, stop:len(y)]
+    svm = make_svm(kernel, **params)
+    if kernel == 'precomputed':
+        svm.fit(X[np.ix_(train, train)], y[train])
+        y_pred = svm.predict(X[start:stop][:, train])
+    else:
+        svm.fit(X[train], y[train])
+        y_pred = svm.predict(X[start:stop])
+    return np.mean(y_pred == y[start:stop])
+
+
+def _fold_job(job):
+    kernel, params, fold, (start, stop) = job
+    return params, fold, fold_accuracy(kernel, params, start, stop,
+                                       _shared['X'], _shared['y'])
+
+
+def _result_key(params, fold):
+    return json.dumps(params, sort_keys=True), fold
+
+
+class CrossValidation(object):
+    '''Mean n_splits-fold accuracy of SVMs with the given kernel ('linear',
+    'rbf' or 'precomputed') on X, y. Fold results are kept in results_file
+    (one JSON line per fold) when given.'''
+
+    def __init__(self, X, y, kernel, n_splits=5, n_workers=1, results_file=None):
+        self.kernel = kernel
+        self.folds = fold_bounds(len(y), n_splits)
+        self.n_workers = n_workers
+        self.results_file = results_file
+        self.results = {}
+        self.n_fits = 0   # fold jobs run by this object (not from the file)
+        if results_file is not None and exists(results_file):
+            for line in open(results_file):
+                try:
+                    r = json.loads(line)
+                except ValueError:
+                    continue  # last line of an interrupted sweep
+                self.results[_result_key(r['params'], r['fold'])] = r['accuracy']
+
+        self._dir = tempfile.mkdtemp()
+        self._files = (join(self._dir, 'X.npy'), join(self._dir, 'y.npy'))
+        np.save(self._files[0], np.ascontiguousarray(X))
+        np.save(self._files[1], np.asarray(y))
+
+    def scores(self, candidates, n_folds=None):
+        '''Mean accuracy of every candidate, a dict of SVM parameters, over
+        the first n_folds folds (all of them by default).'''
+        folds = self.folds[:n_folds]
+        candidates = [dict((k, float(v)) for k, v in c.items()) for c in candidates]
+        jobs = [(self.kernel, params, fold, bounds)
+                for params in candidates
+                for fold, bounds in enumerate(folds)
+                if _result_key(params, fold) not in self.results]
+
+        out = open(self.results_file, 'a') if self.results_file else None
+        try:
+            for params, fold, acc in imap_progress(_fold_job, jobs, self.n_workers,
+                                                   chunksize=1, label='folds',
+                                                   initializer=_open_shared,
+                                                   initargs=self._files):
+                self.results[_result_key(params, fold)] = acc
+                self.n_fits += 1
+                if out is not None:
+                    out.write(json.dumps({'params': params, 'fold': fold,
+                                          'accuracy': acc}, sort_keys=True) + '\n')
+                    out.flush()
+        finally:
+            if out is not None:
+                out.close()
+
+        return [np.mean([self.results[_result_key(params, fold)]
+                         for fold in range(len(folds))])
+                for params in candidates]
+
+    def close(self):
+        shutil.rmtree(self._dir, ignore_errors=True)
+
+
+def coarse_to_fine(grid, evaluate, stride=4):
+    '''Search the dense grid (a dict of parameter name -> candidate values)
+    without evaluating all of it. evaluate(candidates) returns the score of
+    every candidate (a dict of parameter values).
+
+    Every stride-th value of every parameter is evaluated first, then the
+    neighbours at stride // 2, stride // 4, ..., 1 of the best point so far.
+    Returns the best candidate and its score; ties are broken in grid order.
+    '''
+    names = sorted(grid)
+    values = [np.asarray(grid[name]) for name in names]
+    shape = [len(v) for v in values]
+    scores = {}
+
+    def run(axes):
+        points = [p for p in itertools.product(*axes) if p not in scores]
+        candidates = [dict((name, v[i]) for name, v, i in zip(names, values, p))
+                      for p in points]
+        if points:
+            scores.update(zip(points, evaluate(candidates)))
+
+    run([sorted(set(range(0, n, stride)) | set([n - 1])) for n in shape])
+    while stride > 1:
+        stride = (stride + 1) // 2
+        best = max(sorted(scores), key=scores.get)
+        run([sorted(set(min(max(b + k * stride, 0), n - 1) for k in (-1, 0, 1)))
+             for b, n in zip(best, shape)])
+
+    best = max(sorted(scores), key=scores.get)
+    print('{} of {} grid points evaluated'.format(len(scores), int(np.prod(shape))))
+    return dict((name, v[i]) for name, v, i in zip(names, values, best)), scores[best]
+
+
+def successive_halving(candidates, evaluate, n_folds=5, eta=3):
+    '''Score of every candidate, with evaluate(candidates, k) the mean
+    accuracy over the first k folds. Rung i scores the remaining candidates
+    on min(eta**i, n_folds) folds and keeps the best 1/eta of them, until
+    they have been scored on all the folds.
+
+    Only the candidates of the last rung get their full cross-validation
+    score, the others get -inf.
+    '''
+    scores = np.full(len(candidates), -np.inf)
+    alive = np.arange(len(candidates))
+    rung = 0
+    while True:
+        k = min(eta ** rung, n_folds)
+        rung_scores = np.asarray(evaluate([candidates[i] for i in alive], k))
+        if k == n_folds:
+            scores[alive] = rung_scores
+            return scores
+        # best ceil(len / eta), ties in candidate order
+        keep = np.argsort(-rung_scores, kind='mergesort')[:-(-len(alive) // eta)]
+        alive = alive[np.sort(keep)]
+        rung += 1
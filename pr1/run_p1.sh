@@ -3,5 +3,5 @@ workon cv
 rm *.pk
 for i in `seq 1 100`;
     do
-        python lab1.py
+        python lab1.py -s $i
     done  
@@ -1,10 +1,7 @@
 #exercise 2
+# cached artifacts are keyed by their parameters, only the vocabulary and
+# BoVWs of every new number of clusters are computed
 for i in `seq 80 5 120`;
     do
-        rm  cache/*.dat
-        rm  cache/*.feat
-        cd cache
-        rm **/*.bovw
-        cd ..
         python lab1.py -c $i -t 4 -k rbf
-    done  
+    done
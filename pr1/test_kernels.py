@@ -0,0 +1,18 @@
+from kernels import intersection_kernel
+import numpy as np
+
+random_state = np.random.RandomState(0)
+X = random_state.rand(37, 5)
+Y = random_state.rand(11, 5)
+ref = np.minimum(X[:, None, :], Y[None, :, :]).sum(axis=2)
+
+assert(np.allclose(intersection_kernel(X, Y), ref))
+# row blocks, tiny broadcast temporaries and threads give the same matrix
+assert(np.allclose(intersection_kernel(X, Y, n_workers=3, block_rows=4, max_cells=7), ref))
+
+# training Gram matrix: symmetric, self-intersection on the diagonal
+K = intersection_kernel(X, n_workers=2, block_rows=8)
+assert(K.shape == (37, 37) and np.allclose(K, K.T))
+assert(np.allclose(np.diag(K), X.sum(axis=1)))
+
+assert(intersection_kernel(X[:0], Y).shape == (0, 11))
@@ -0,0 +1,28 @@
+from lab1 import encode_bovw
+from assignment import WordAssigner
+import numpy as np
+
+random_state = np.random.RandomState(0)
+vocabulary = random_state.randn(6, 4)
+features = [random_state.randn(n, 4) for n in (7, 0, 1, 30)]
+
+# reference: per-image histogram of the nearest words, sqrt + L2 norm
+words = [np.argmin(np.sum((f[:, None, :] - vocabulary[None]) ** 2, axis=2), axis=1)
+         for f in features]
+ref = np.sqrt([np.bincount(w, minlength=6) for w in words])
+ref /= np.linalg.norm(ref, axis=1)[:, None] + 1e-7
+
+bovw = encode_bovw(vocabulary, features)
+assert(bovw.shape == (4, 6))
+assert(np.allclose(bovw, ref, atol=1e-5))
+# every word has its own bin, the last one included
+assert(np.array_equal(bovw[3] > 0, np.bincount(words[3], minlength=6) > 0))
+# images without features get an empty BoVW
+assert(np.all(bovw[1] == 0))
+
+# blocks of a few rows give the same matrix
+assert(np.allclose(encode_bovw(WordAssigner(vocabulary), features, block_rows=5), bovw))
+
+# L1 normalization
+bovw1 = encode_bovw(vocabulary, features, norm=1)
+assert(np.allclose(bovw1[[0, 2, 3]].sum(axis=1), 1, atol=1e-5))
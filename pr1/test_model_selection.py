@@ -0,0 +1,62 @@
+from model_selection import CrossValidation, coarse_to_fine, fold_bounds
+import os
+import tempfile
+import numpy as np
+
+# contiguous folds, the last one takes the remainder
+assert(fold_bounds(11, 5) == [(0, 2), (2, 4), (4, 6), (6, 8), (8, 11)])
+assert(fold_bounds(10, 5)[-1] == (8, 10))
+
+# coarse-to-fine finds the maximum of a unimodal grid without evaluating it all
+grid = {'C': np.arange(3, 7, .2), 'gamma': np.arange(2, 6, .2)}
+evaluated = []
+def evaluate(candidates):
+    evaluated.extend(candidates)
+    return [-(c['C'] - 5.2) ** 2 - (c['gamma'] - 2.6) ** 2 for c in candidates]
+best, score = coarse_to_fine(grid, evaluate)
+assert(np.isclose(best['C'], 5.2) and np.isclose(best['gamma'], 2.6))
+assert(len(evaluated) < 100)
+assert(len(set((c['C'], c['gamma']) for c in evaluated)) == len(evaluated))
+
+# separable 3-class problem
+random_state = np.random.RandomState(0)
+y = random_state.randint(0, 3, 150)
+X = random_state.randn(150, 5)
+X[np.arange(150), y] += 4
+
+results_file = os.path.join(tempfile.mkdtemp(), 'cv.jsonl')
+candidates = [{'C': 0.5}, {'C': 2.}]
+cv = CrossValidation(X, y, 'linear', n_workers=2, results_file=results_file)
+scores = cv.scores(candidates)
+cv.close()
+assert(cv.n_fits == 10 and np.all(np.array(scores) > 0.9))
+
+# a second run with the same inputs reads every fold from the results file
+cv = CrossValidation(X, y, 'linear', results_file=results_file)
+assert(cv.scores(candidates) == scores and cv.n_fits == 0)
+# a new candidate only runs its own folds
+cv.scores([{'C': 1.}])
+assert(cv.n_fits == 5)
+cv.close()
+
+# precomputed kernels slice the training Gram matrix
+cv = CrossValidation(np.dot(X, X.T), y, 'precomputed')
+assert(cv.scores([{'C': 1.}])[0] > 0.9)
+cv.close()
+
+# successive halving: rung sizes and budgets, only the last rung is scored
+from model_selection import successive_halving
+rungs = []
+def evaluate_rung(candidates, n_folds):
+    rungs.append((len(candidates), n_folds))
+    return [-abs(c['C'] - 3.) for c in candidates]
+Cs = [{'C': C} for C in np.arange(2, 4, .2)]
+scores = successive_halving(Cs, evaluate_rung, n_folds=5, eta=3)
+assert(rungs == [(10, 1), (4, 3), (2, 5)])
+assert(np.sum(np.isfinite(scores)) == 2 and np.argmax(scores) == 5)
+
+# promoted candidates only train on their new folds: 10 + 4 * 2 + 2 * 2
+cv = CrossValidation(X, y, 'linear')
+scores = successive_halving(Cs, cv.scores)
+assert(cv.n_fits == 22 and np.isfinite(scores).sum() == 2)
+cv.close()
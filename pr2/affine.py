@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+'''Affine transform estimation + RANSAC, vectorized over hypotheses.
+
+An affine transform is stored as a 3x2 matrix M, so that points are mapped
+as [x, y, 1] M.
+'''
+from __future__ import print_function
+from __future__ import division
+
+import numpy as np
+
+
+def homogeneous(xy):
+    return np.column_stack((xy, np.ones(len(xy), dtype=xy.dtype)))
+
+
+def apply_affine(M, xy):
+    return np.dot(homogeneous(xy), M)
+
+
+def estimate_affine(src, dst):
+    '''Least-squares affine transform mapping src onto dst (>= 3 points).'''
+    M, _, _, _ = np.linalg.lstsq(homogeneous(np.asarray(src, dtype=np.float64)),
+                                 np.asarray(dst, dtype=np.float64), rcond=-1)
+    return M
+
+
+def estimate_affine_minimal(src, dst, min_det=1e-3):
+    '''Exact affine transforms from stacks of 3 correspondences.
+
+    src, dst: (n_hyp, 3, 2) arrays. Returns (M, valid), M being (n_hyp, 3, 2);
+    hypotheses with (nearly) collinear source points are not valid.
+    '''
+    A = np.concatenate((src, np.ones(src.shape[:2] + (1,))), axis=2)
+    valid = np.abs(np.linalg.det(A)) > min_det
+    M = np.zeros((len(src), 3, 2))
+    if np.any(valid):
+        M[valid] = np.linalg.solve(A[valid], dst[valid])
+    return M, valid
+
+
+def ransac_affine(src, dst, threshold=6., max_trials=350, confidence=0.99,
+                  batch_size=50, random_state=None):
+    '''Robust affine fit between matched points src[i] <-> dst[i].
+
+    Hypotheses are drawn batch_size at a time; each batch is solved as a
+    stack of 3x3 linear systems and all its residuals are computed in one
+    broadcast operation. Stops once the number of trials needed to find an
+    all-inlier sample with the given confidence (given the current inlier
+    ratio) has been reached. Returns (M, inliers); M is None if no model
+    could be fit.
+    '''
+    if random_state is None:
+        random_state = np.random.RandomState()
+
+    src = np.asarray(src, dtype=np.float64).reshape(-1, 2)
+    dst = np.asarray(dst, dtype=np.float64).reshape(-1, 2)
+    n = len(src)
+    best_inliers = np.zeros(n, dtype=bool)
+    if n < 3:
+        return None, best_inliers
+
+    src_h = homogeneous(src)
+    thr2 = threshold ** 2
+    best_count = 0
+    n_trials, n_needed = 0, max_trials
+    while n_trials < min(n_needed, max_trials):
+        n_hyp = min(batch_size, max_trials - n_trials)
+        n_trials += n_hyp
+
+        # minimal samples of 3 distinct correspondences
+        samples = random_state.randint(0, n, (n_hyp, 3))
+        distinct = ((samples[:, 0] != samples[:, 1]) &
+                    (samples[:, 0] != samples[:, 2]) &
+                    (samples[:, 1] != samples[:, 2]))
+        samples = samples[distinct]
+        M, valid = estimate_affine_minimal(src[samples], dst[samples])
+        M = M[valid]
+        if len(M) == 0:
+            continue
+
+        # (n_hyp, n) squared residuals of all the hypotheses at once
+        res2 = np.sum((np.einsum('nk,hkj->hnj', src_h, M) - dst) ** 2, axis=2)
+        inliers = res2 < thr2
+        counts = inliers.sum(axis=1)
+        best = np.argmax(counts)
+        if counts[best] > best_count:
+            best_count = counts[best]
+            best_inliers = inliers[best]
+
+            # adaptive number of trials
+            w3 = (best_count / n) ** 3
+            if w3 >= 1.:
+                n_needed = 0
+            else:
+                n_needed = np.log(1. - confidence) / np.log1p(-w3)
+
+    if best_count < 3:
+        return None, best_inliers
+
+    # refine on the consensus set
+    M = estimate_affine(src[best_inliers], dst[best_inliers])
+    inliers = np.sum((np.dot(src_h, M) - dst) ** 2, axis=1) < thr2
+    if inliers.sum() < best_count:
+        # the least squares fit lost part of the consensus set
+        inliers = best_inliers
+    return M, inliers
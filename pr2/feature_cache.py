@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+from __future__ import division
+
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+class FeatureCache(object):
+    '''Bounded LRU cache of per-image feature dicts, keyed by image id.
+
+    loader(image_id) must return a dict of numpy arrays (e.g. keypoint
+    coordinates and projected descriptors, ready for matching). Least
+    recently used entries are evicted once the arrays held exceed max_bytes
+    or there are more than max_items entries. The arrays are copied on
+    insert, so views of memory-mapped files (e.g. FeatureStore slices) are
+    held in memory and max_bytes bounds what the cache really keeps
+    resident.
+
+    get() can be called from several threads; loads run outside the lock,
+    so images missing from the cache are loaded concurrently.
+    '''
+
+    def __init__(self, loader, max_bytes=256 * 2**20, max_items=None):
+        self.loader = loader
+        self.max_bytes = max_bytes
+        self.max_items = max_items
+
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, image_id):
+        return image_id in self._items
+
+    def get(self, image_id):
+        with self._lock:
+            if image_id in self._items:
+                self.hits += 1
+                # move to the most recently used end
+                item = self._items.pop(image_id)
+                self._items[image_id] = item
+                return item
+            self.misses += 1
+
+        item = dict((k, np.array(v)) for k, v in self.loader(image_id).items())
+        with self._lock:
+            if image_id in self._items:
+                # loaded by another thread meanwhile, keep that copy
+                return self._items[image_id]
+            self._items[image_id] = item
+            self.nbytes += sum(v.nbytes for v in item.values())
+            self._evict()
+        return item
+
+    def _evict(self):
+        # never evict the entry just inserted, even if it is over the limit
+        while len(self._items) > 1 and (
+                self.nbytes > self.max_bytes or
+                (self.max_items is not None and len(self._items) > self.max_items)):
+            _, item = self._items.popitem(last=False)
+            self.nbytes -= sum(v.nbytes for v in item.values())
+            self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.nbytes = 0
+
+    @property
+    def stats(self):
+        n_requests = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions, 'items': len(self._items),
+                'bytes': self.nbytes,
+                'hit_rate': self.hits / n_requests if n_requests else 0.}
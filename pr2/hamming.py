@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+'''Hamming embedding of local descriptors.
+
+Jegou, H., Douze, M., & Schmid, C. (2008). Hamming embedding and weak
+geometric consistency for large scale image search. ECCV.
+
+Every descriptor gets, besides its visual word, an n_bits binary signature:
+the signs of a random orthogonal projection, thresholded at the median of the
+training descriptors of the same word. Features that share a word only vote
+for an image if their signatures are within a Hamming distance threshold.
+'''
+from __future__ import print_function
+from __future__ import division
+
+import numpy as np
+
+from search import top_k
+
+# bits set in every byte value, for NumPy versions without bitwise_count
+_POPCOUNT8 = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+def popcount(x):
+    '''Number of bits set in every element of a uint64 array.'''
+    x = np.ascontiguousarray(x, dtype=np.uint64)
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(x)
+    return _POPCOUNT8[x.view(np.uint8)].reshape(x.shape + (8,)).sum(axis=-1, dtype=np.uint8)
+
+
+def pack_bits(bits):
+    '''(n, n_bits <= 64) booleans -> (n,) uint64 signatures.'''
+    bits = np.asarray(bits, dtype=bool)
+    packed = np.zeros((len(bits), 8), dtype=np.uint8)
+    packed[:, :(bits.shape[1] + 7) // 8] = np.packbits(bits, axis=1)
+    return packed.view(np.uint64).ravel()
+
+
+class HammingEmbedding(object):
+    '''Random orthogonal projection to n_bits dimensions plus per-word
+    median thresholds.'''
+
+    def __init__(self, n_bits=64):
+        if n_bits > 64:
+            raise ValueError('signatures are single uint64 words, n_bits <= 64')
+        self.n_bits = n_bits
+        self.projection = np.zeros((0, n_bits), dtype=np.float32)
+        self.medians = np.zeros((0, n_bits), dtype=np.float32)
+
+    def fit(self, samples, words, n_words, random_state=None):
+        '''samples: training descriptors, words: their visual words.'''
+        if random_state is None:
+            random_state = np.random.RandomState()
+        ndim = samples.shape[1]
+        if self.n_bits > ndim:
+            raise ValueError('more bits than descriptor dimensions')
+        # orthogonal columns from the QR decomposition of a gaussian matrix
+        q, _ = np.linalg.qr(random_state.randn(ndim, ndim))
+        self.projection = q[:, :self.n_bits].astype(np.float32)
+
+        proj = np.dot(np.asarray(samples, dtype=np.float32), self.projection)
+        words = np.asarray(words)
+        # words without training samples fall back to the global median
+        self.medians = np.tile(np.median(proj, axis=0), (n_words, 1)).astype(np.float32)
+        order = np.argsort(words, kind='mergesort')
+        uniq, start = np.unique(words[order], return_index=True)
+        for w, group in zip(uniq, np.split(order, start[1:])):
+            self.medians[w] = np.median(proj[group], axis=0)
+        return self
+
+    def signatures(self, desc, words):
+        proj = np.dot(np.asarray(desc, dtype=np.float32).reshape(len(words), -1),
+                      self.projection)
+        return pack_bits(proj > self.medians[words])
+
+    def save(self, filename):
+        with open(filename, 'wb') as fh:
+            np.savez(fh, projection=self.projection, medians=self.medians)
+
+    @classmethod
+    def load(cls, filename):
+        with open(filename, 'rb') as fh:
+            data = np.load(fh)
+            he = cls(data['projection'].shape[1])
+            he.projection, he.medians = data['projection'], data['medians']
+        return he
+
+
+class HammingIndex(object):
+    '''Inverted file with one posting (doc_id, signature) per database
+    descriptor, in CSR form like InvertedIndex.
+
+    A query descriptor votes for the images of the postings of its word
+    whose signature is within `threshold` bits of its own; votes are
+    weighted by idf**2 and image scores divided by the L2 norm of their
+    tf-idf BoVW. Images can be added and removed, which rebuilds the
+    posting lists (like IncrementalIndex.commit()).
+    '''
+
+    def __init__(self, n_words, n_docs=0):
+        self.n_words = n_words
+        self.n_docs = n_docs
+        self.offsets = np.zeros(n_words + 1, dtype=np.int64)
+        self.doc_ids = np.zeros(0, dtype=np.int32)
+        self.signatures = np.zeros(0, dtype=np.uint64)
+        self.idf = np.zeros(n_words, dtype=np.float32)
+        self.norm = np.zeros(n_docs, dtype=np.float32)
+        self.names_digest = ''  # optional, like InvertedIndex.names_digest
+
+    @classmethod
+    def from_features(cls, n_words, n_docs, doc_ids, words, signatures):
+        '''Build the index from per-descriptor (doc_id, word, signature).'''
+        index = cls(n_words, n_docs)
+        doc_ids = np.asarray(doc_ids, dtype=np.int32)
+        words = np.asarray(words, dtype=np.int64)
+
+        order = np.argsort(words, kind='mergesort')
+        index.doc_ids = doc_ids[order]
+        index.signatures = np.asarray(signatures, dtype=np.uint64)[order]
+        index.offsets[1:] = np.cumsum(np.bincount(words, minlength=n_words))
+
+        # idf over images + tf-idf norms, from the distinct (doc_id, word) pairs
+        pairs, tf = np.unique(doc_ids.astype(np.int64) * n_words + words,
+                              return_counts=True)
+        pair_docs, pair_words = pairs // n_words, pairs % n_words
+        df = np.bincount(pair_words, minlength=n_words)
+        n = len(np.unique(pair_docs))
+        index.idf = np.log(n / (df + 2**-23)).astype(np.float32)
+        index.norm = np.sqrt(np.bincount(pair_docs, weights=(tf * index.idf[pair_words]) ** 2,
+                                         minlength=n_docs)).astype(np.float32)
+        return index
+
+    @property
+    def nnz(self):
+        return len(self.doc_ids)
+
+    def _rebuild(self, n_docs, doc_ids, words, signatures):
+        index = HammingIndex.from_features(self.n_words, n_docs, doc_ids, words, signatures)
+        index.names_digest = self.names_digest
+        self.__dict__.update(index.__dict__)
+
+    def _features(self):
+        # (doc_id, word, signature) of every posting
+        words = np.repeat(np.arange(self.n_words), np.diff(self.offsets))
+        return self.doc_ids, words, self.signatures
+
+    def add(self, n_docs, doc_ids, words, signatures):
+        '''Add the descriptors (doc_id, word, signature) of new images, the
+        index then holds n_docs images; idf and norms are recomputed.'''
+        if n_docs < self.n_docs:
+            raise ValueError('an index of {} images cannot shrink to {}'.format(
+                self.n_docs, n_docs))
+        old_ids, old_words, old_sigs = self._features()
+        self._rebuild(n_docs, np.concatenate((old_ids, np.asarray(doc_ids, dtype=np.int32))),
+                      np.concatenate((old_words, np.asarray(words, dtype=np.int64))),
+                      np.concatenate((old_sigs, np.asarray(signatures, dtype=np.uint64))))
+
+    def remove(self, doc_ids):
+        '''Drop all the descriptors of the images doc_ids (ids of the other
+        images do not change).'''
+        old_ids, old_words, old_sigs = self._features()
+        keep = ~np.isin(old_ids, doc_ids)
+        self._rebuild(self.n_docs, old_ids[keep], old_words[keep], old_sigs[keep])
+
+    def scores(self, words, signatures, threshold, max_pairs=2**22):
+        '''Scores of all the images for the query descriptors (words,
+        signatures) of one image.'''
+        words = np.asarray(words, dtype=np.int64)
+        signatures = np.asarray(signatures, dtype=np.uint64)
+        weights = self.idf ** 2
+        S = np.zeros(self.n_docs, dtype=np.float64)
+
+        start = self.offsets[words]
+        length = self.offsets[words + 1] - start
+        # query descriptors in chunks of about max_pairs (query, posting) pairs
+        bounds = np.searchsorted(np.cumsum(length), np.arange(max_pairs, length.sum(), max_pairs))
+        for chunk in np.split(np.arange(len(words)), np.unique(bounds) + 1):
+            if len(chunk) == 0:
+                continue
+            n_pairs = length[chunk]
+            pos = np.repeat(chunk, n_pairs)
+            first = np.repeat(np.cumsum(n_pairs) - n_pairs, n_pairs)
+            sel = np.repeat(start[chunk], n_pairs) + np.arange(len(pos)) - first
+
+            dist = popcount(self.signatures[sel] ^ signatures[pos])
+            match = dist <= threshold
+            S += np.bincount(self.doc_ids[sel[match]], weights=weights[words[pos[match]]],
+                             minlength=self.n_docs)
+
+        # images without descriptors (e.g. removed) never rank
+        return np.where(self.norm > 0, S / (self.norm + 2**-23), -np.inf)
+
+    def search(self, query_words, query_signatures, k, threshold):
+        '''Top-k images for every query (lists of per-image words and
+        signatures); returns (ids, scores) like QueryEngine.search().'''
+        scores = np.vstack([self.scores(w, s, threshold)
+                            for w, s in zip(query_words, query_signatures)])
+        ids = top_k(scores, k)
+        return ids, np.take_along_axis(scores, ids, axis=1)
+
+    def save(self, filename):
+        with open(filename, 'wb') as fh:
+            np.savez(fh, offsets=self.offsets, doc_ids=self.doc_ids,
+                     signatures=self.signatures, idf=self.idf, norm=self.norm,
+                     names_digest=np.array(self.names_digest))
+
+    @classmethod
+    def load(cls, filename):
+        with open(filename, 'rb') as fh:
+            data = np.load(fh)
+            index = cls(len(data['offsets']) - 1, len(data['norm']))
+            for name in ('offsets', 'doc_ids', 'signatures', 'idf', 'norm'):
+                setattr(index, name, data[name])
+            if 'names_digest' in data.files:
+                index.names_digest = str(data['names_digest'])
+        return index
@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+from __future__ import division
+
+import sys
+import threading
+from os.path import join, split, abspath
+
+import numpy as np
+
+from inverted_index import InvertedIndex
+from search import QueryEngine, SCORING_MODES, top_k
+
+sys.path.append(join(split(abspath(__file__))[0], '..', 'common'))
+from dtypes import FLOAT
+
+
+def _posting_words(index, pos):
+    # word of the postings at positions pos, from the posting list offsets
+    return np.searchsorted(index.offsets, pos, side='right') - 1
+
+
+class IncrementalIndex(object):
+    '''InvertedIndex that takes additions and removals without a rebuild.
+
+    The committed postings live in a read-only base segment (usually memory
+    mapped from `filename`). add() puts new images in a small delta segment
+    and remove() marks images as deleted (tombstones); both keep n, df, idf,
+    norm and nd up to date, so scores are the same as those of a rebuilt
+    index. commit() merges delta and tombstones into a new base segment,
+    optionally in a background thread, and swaps it in under a lock.
+    '''
+
+    def __init__(self, base, filename=None):
+        self.filename = filename
+        self.n_words = base.n_words
+        self.vocabulary = base.vocabulary
+        self.names_digest = base.names_digest   # written by commit()
+        self._lock = threading.RLock()
+        self._merging = None
+
+        # statistics of the live documents (base + delta - removed)
+        self.n = base.n
+        self.df = np.array(base.df, dtype=np.int32)
+        self.norm = np.array(base.norm, dtype=np.float32)
+        self.nd = np.array(base.nd, dtype=np.float32)
+        self.alive = self.norm > 0
+
+        self._set_base(base)
+        self._delta = {}    # doc_id -> (words, counts) added since the last commit
+        self._delta_engine = None
+
+    @property
+    def n_docs(self):
+        return len(self.nd)
+
+    @property
+    def idf(self):
+        # number of documents / number of documents where the VW appears
+        return np.log(self.n / (self.df + 2**-23)).astype(np.float32)
+
+    def _set_base(self, base):
+        self._base = base
+        self._base_engine = QueryEngine(base)
+
+    def add(self, words):
+        '''Index a new image given the visual words of its local features;
+        returns its document id (the next free position in the id space).'''
+        words = np.asarray(words, dtype=np.int64)
+        idx, count = np.unique(words, return_counts=True)
+        with self._lock:
+            doc_id = self.n_docs
+            self.nd = np.append(self.nd, np.float32(len(words)))
+            self.norm = np.append(self.norm, np.float32(count.sum()))
+            self.alive = np.append(self.alive, len(idx) > 0)
+            if len(idx) > 0:
+                self._delta[doc_id] = (idx, count.astype(np.float32))
+                self.df[idx] += 1
+                self.n += 1
+                self._delta_engine = None
+            return doc_id
+
+    def remove(self, doc_id):
+        '''Delete an image from the index.'''
+        with self._lock:
+            if not (0 <= doc_id < self.n_docs and self.alive[doc_id]):
+                raise KeyError('document {} not in the index'.format(doc_id))
+            if doc_id in self._delta:
+                words, _ = self._delta.pop(doc_id)
+                self._delta_engine = None
+            else:
+                words = _posting_words(self._base,
+                                       np.nonzero(self._base.doc_ids == doc_id)[0])
+            self.df[words] -= 1
+            self.n -= 1
+            self.alive[doc_id] = False
+
+    def __contains__(self, doc_id):
+        return 0 <= doc_id < self.n_docs and bool(self.alive[doc_id])
+
+    def _merged(self, base, delta, alive, names_digest):
+        # base postings of the documents still alive + the delta postings
+        keep = alive[base.doc_ids]
+        doc_ids = [base.doc_ids[keep]]
+        words = [_posting_words(base, np.nonzero(keep)[0])]
+        counts = [base.weights[keep]]
+        for doc_id in sorted(delta):
+            idx, count = delta[doc_id]
+            doc_ids.append(np.full(len(idx), doc_id, dtype=np.int32))
+            words.append(idx)
+            counts.append(count)
+        nd = np.where(alive, self.nd[:len(alive)], 0).astype(np.float32)
+        merged = InvertedIndex.from_postings(self.n_words,
+                                             np.concatenate(doc_ids),
+                                             np.concatenate(words),
+                                             np.concatenate(counts), nd)
+        merged.names_digest = names_digest
+
+        if self.filename is not None:
+            # written aside and renamed, readers of the old file are not affected
+            merged.save(self.filename, self.vocabulary)
+            merged = InvertedIndex.load(self.filename)
+        else:
+            merged.vocabulary = self.vocabulary
+        return merged
+
+    def commit(self, background=False):
+        '''Merge the pending changes into a new base segment (saved to
+        `filename`, if any). With background=True the merge runs in a thread
+        that is returned; the index can be searched and updated meanwhile,
+        changes made during the merge stay pending for the next commit.'''
+        self.wait()
+        with self._lock:
+            delta = dict(self._delta)
+            alive = self.alive.copy()
+            base = self._base
+            names_digest = self.names_digest
+
+        def merge():
+            merged = self._merged(base, delta, alive, names_digest)
+            with self._lock:
+                self._set_base(merged)
+                for doc_id in delta:
+                    self._delta.pop(doc_id, None)
+                self._delta_engine = None
+
+        if not background:
+            merge()
+            return None
+        self._merging = threading.Thread(target=merge)
+        self._merging.daemon = True
+        self._merging.start()
+        return self._merging
+
+    def wait(self):
+        '''Block until a background commit is done.'''
+        if self._merging is not None:
+            self._merging.join()
+            self._merging = None
+
+    @property
+    def pending(self):
+        '''Number of documents added (not yet merged) and removed since the
+        last commit.'''
+        with self._lock:
+            n_removed = int(np.count_nonzero(~self.alive[:self._base.n_docs] &
+                                             (self._base.norm > 0)))
+            return len(self._delta), n_removed
+
+    def _delta_scores(self, Q, mode, idf):
+        if self._delta_engine is None:
+            doc_ids = [np.full(len(w), d, dtype=np.int32)
+                       for d, (w, _) in sorted(self._delta.items())]
+            words = [w for _, (w, _) in sorted(self._delta.items())]
+            counts = [c for _, (_, c) in sorted(self._delta.items())]
+            delta = InvertedIndex.from_postings(self.n_words,
+                                                np.concatenate(doc_ids),
+                                                np.concatenate(words),
+                                                np.concatenate(counts), self.nd)
+            self._delta_engine = QueryEngine(delta)
+        self._delta_engine.set_idf(idf)
+        return self._delta_engine.scores(Q, mode)
+
+    def scores(self, Q, mode='cosine'):
+        '''Dense (n_queries x n_docs) score matrix, see QueryEngine.scores();
+        removed documents score -inf.'''
+        if mode not in SCORING_MODES:
+            raise ValueError('unknown scoring mode: {}'.format(mode))
+        with self._lock:
+            idf = self.idf
+            self._base_engine.set_idf(idf)
+            base_scores = self._base_engine.scores(Q, mode)
+            if self._delta:
+                S = self._delta_scores(Q, mode, idf)
+                S[:, :base_scores.shape[1]] += base_scores
+            else:
+                S = np.zeros((base_scores.shape[0], self.n_docs), dtype=FLOAT)
+                S[:, :base_scores.shape[1]] = base_scores
+            S[:, ~self.alive] = -np.inf
+        return S
+
+    def search(self, Q, k, mode='cosine'):
+        '''Top-k live documents for every query; returns (ids, scores).'''
+        scores = self.scores(Q, mode)
+        ids = top_k(scores, min(k, self.n))
+        return ids, np.take_along_axis(scores, ids, axis=1)
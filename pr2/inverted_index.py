@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+from __future__ import division
+
+import os
+
+import numpy as np
+
+# index file: an 80-byte header followed by the sections below, in this order,
+# each one starting at a multiple of ALIGN bytes
+MAGIC = b'BOVWINDX'
+VERSION = 2
+ALIGN = 64
+HEADER = np.dtype([('magic', 'S8'), ('version', '<u8'), ('n_words', '<u8'),
+                   ('n_docs', '<u8'), ('n', '<u8'), ('nnz', '<u8'),
+                   ('vocab_rows', '<u8'), ('vocab_dim', '<u8'),
+                   ('names_digest', 'S16')])
+
+
+def _sections(h):
+    return [('vocabulary', '<f4', (h['vocab_rows'], h['vocab_dim'])),
+            ('df', '<i4', (h['n_words'],)),
+            ('idf', '<f4', (h['n_words'],)),
+            ('norm', '<f4', (h['n_docs'],)),
+            ('nd', '<f4', (h['n_docs'],)),
+            ('offsets', '<i8', (h['n_words'] + 1,)),
+            ('doc_ids', '<i4', (h['nnz'],)),
+            ('weights', '<f4', (h['nnz'],))]
+
+
+def _layout(h):
+    # (name, dtype, shape, file offset) of every section
+    layout = []
+    offset = HEADER.itemsize
+    for name, dtype, shape in _sections(h):
+        offset = -(-offset // ALIGN) * ALIGN
+        shape = tuple(int(s) for s in shape)
+        layout.append((name, np.dtype(dtype), shape, offset))
+        offset += int(np.prod(shape)) * np.dtype(dtype).itemsize
+    return layout
+
+
+class InvertedIndex(object):
+    '''Inverted file with posting lists stored in CSR form.
+
+    The postings of visual word w are doc_ids[offsets[w]:offsets[w + 1]],
+    weights holds the number of times w appears in each of those images.
+    Document ids are positions in the image list; names_digest can record
+    which list (e.g. artifacts.digest() of it).
+    '''
+
+    def __init__(self, n_words, n_docs=0):
+        self.n_words = n_words
+        self.n_docs = n_docs                                 # size of id space
+        self.n = 0                                           # n documents
+        self.df = np.zeros(n_words, dtype=np.int32)          # doc. frec.
+        self.offsets = np.zeros(n_words + 1, dtype=np.int64) # inv. file
+        self.doc_ids = np.zeros(0, dtype=np.int32)
+        self.weights = np.zeros(0, dtype=np.float32)
+        self.norm = np.zeros(n_docs, dtype=np.float32)       # L1-norms
+        self.nd = np.zeros(n_docs, dtype=np.float32)         # number of features per image
+        self.idf = np.zeros(n_words, dtype=np.float32)
+        self.vocabulary = np.zeros((0, 0), dtype=np.float32) # optional copy
+        self.names_digest = ''  # optional digest of the names of the documents
+
+    @classmethod
+    def from_postings(cls, n_words, doc_ids, words, counts, nd):
+        '''Build the index from (doc_id, word, count) triplets.
+
+        Each (doc_id, word) pair must appear at most once; nd holds the number
+        of local features of every document in the id space.
+        '''
+        nd = np.asarray(nd, dtype=np.float32)
+        index = cls(n_words, len(nd))
+
+        doc_ids = np.asarray(doc_ids, dtype=np.int32)
+        words = np.asarray(words, dtype=np.int64)
+        counts = np.asarray(counts, dtype=np.float32)
+
+        # stable sort so that each posting list keeps the insertion order
+        order = np.argsort(words, kind='mergesort')
+        index.doc_ids = doc_ids[order]
+        index.weights = counts[order]
+
+        index.df = np.bincount(words, minlength=n_words).astype(np.int32)
+        index.offsets[1:] = np.cumsum(index.df)
+
+        index.norm = np.bincount(doc_ids, weights=counts,
+                                 minlength=index.n_docs).astype(np.float32)
+        index.nd = nd
+        index.n = int(np.count_nonzero(index.norm))
+        # number of documents / number of documents where the VW appears
+        index.idf = np.log(index.n / (index.df + 2**-23)).astype(np.float32)
+        return index
+
+    @property
+    def nnz(self):
+        return len(self.doc_ids)
+
+    def postings(self, words):
+        '''Concatenated posting lists of the given words.
+
+        Returns (pos, doc_ids, weights), where pos[j] is the position in
+        `words` of the word that posting j belongs to.
+        '''
+        words = np.asarray(words, dtype=np.int64)
+        start = self.offsets[words]
+        length = self.offsets[words + 1] - start
+
+        pos = np.repeat(np.arange(len(words)), length)
+        # offset of every posting within its own list
+        first = np.repeat(np.cumsum(length) - length, length)
+        sel = np.repeat(start, length) + np.arange(len(pos)) - first
+        return pos, self.doc_ids[sel], self.weights[sel]
+
+    def save(self, filename, vocabulary=None):
+        '''Write the index (and optionally the vocabulary) in the binary
+        format read by load(). The file is written aside and renamed over
+        filename, so a crash never leaves a truncated index behind and
+        readers of the old file are not affected.'''
+        if vocabulary is not None:
+            self.vocabulary = np.asarray(vocabulary, dtype=np.float32)
+        h = np.zeros((), dtype=HEADER)
+        h['magic'], h['version'] = MAGIC, VERSION
+        h['n_words'], h['n_docs'], h['n'] = self.n_words, self.n_docs, self.n
+        h['nnz'] = self.nnz
+        h['vocab_rows'], h['vocab_dim'] = self.vocabulary.shape
+        h['names_digest'] = self.names_digest.encode('ascii')
+
+        tmp_file = filename + '.tmp'
+        with open(tmp_file, 'wb') as fh:
+            fh.write(h.tobytes())
+            for name, dtype, shape, offset in _layout(h):
+                fh.write(b'\0' * (offset - fh.tell()))
+                data = np.ascontiguousarray(getattr(self, name), dtype=dtype)
+                fh.write(data.reshape(shape).tobytes())
+        os.rename(tmp_file, filename)
+
+    @classmethod
+    def load(cls, filename):
+        '''Open an index file; arrays are read-only memory maps, so opening
+        takes constant time and processes share the page cache.'''
+        h = np.fromfile(filename, dtype=HEADER, count=1)
+        if len(h) == 0 or h[0]['magic'] != MAGIC:
+            raise IOError('not an index file')
+        h = h[0]
+        if h['version'] != VERSION:
+            raise IOError('unsupported index version {}'.format(h['version']))
+
+        index = cls(int(h['n_words']), int(h['n_docs']))
+        index.n = int(h['n'])
+        index.names_digest = h['names_digest'].decode('ascii')
+        for name, dtype, shape, offset in _layout(h):
+            if np.prod(shape) == 0:
+                data = np.zeros(shape, dtype=dtype)
+            else:
+                data = np.memmap(filename, dtype=dtype, mode='r',
+                                 offset=offset, shape=shape)
+            setattr(index, name, data)
+        return index
@@ -36,94 +36,160 @@ from __future__ import print_function
 from __future__ import division
 
 import sys
+from itertools import islice
+from multiprocessing.pool import ThreadPool
 
-from os import listdir, makedirs
+from os import listdir, makedirs, remove
 from os.path import join, splitext, abspath, split, exists
 
 import numpy as np
 np.seterr(all='raise')
 
-import cv2
-
 from utils import load_data, save_data, load_index, save_index, get_random_sample, compute_features, arr2kp
+from utils import precompute_features, FEATURE_PARAMS
+from inverted_index import InvertedIndex
+from search import bovw_matrix
+from incremental import IncrementalIndex
+from shards import ShardedIndex, split_index, shard_filename
+from feature_cache import FeatureCache
+from affine import ransac_affine
+from matching import QueryMatcher
+from pq import ProductQuantizer
+from hamming import HammingEmbedding, HammingIndex
+from rerank import rerank_scores, rerank_order
+from pca import PCA
 
 from sklearn.cluster import KMeans
-from scipy.spatial import distance
-
-import base64
 
-from skimage.measure import ransac
-from skimage.transform import AffineTransform
+sys.path.append(join(split(abspath(__file__))[0], '..', 'common'))
+from vocab_tree import VocabularyTree
+from assignment import WordAssigner
+from feature_store import FeatureStore, iter_feature_batches
+from dtypes import FLOAT, as_float
+from artifacts import ArtifactCache, digest
 
 N_QUERY = 100
+N_SHORT_LIST = 100
+N_WORKERS = None  # feature extraction processes, None = all cores
+FEATURE_CACHE_MB = 256  # memory for the re-ranking features cache
+RERANK_WORKERS = 4      # threads checking short list candidates
+RERANK_BUDGET = None    # re-ranking time limit per query (seconds)
+N_SHARDS = 1            # index shards, each one searched by its own process
 GEO_CHECK = False
 NORM_L2 = False
 pca_dim = 32
 pca_enabled = False
+PCA_METHOD = 'eigh'  # 'eigh' (all components) or 'randomized' (top pca_dim)
+PCA_BATCH = 10000   # descriptors per PCA training batch
+VOCAB_TREE = False  # approximate word assignment with a vocabulary tree
+tree_depth = 3      # n_clusters words, branch factor n_clusters**(1/depth)
+SCORING = 'intersection'  # one of search.SCORING_MODES (incl. additive 'chi2', 'hellinger')
+MATCHING = 'ratio'  # one of 'ratio', 'mutual', 'ratio+mutual', 'words'
+PQ_CODES = False    # re-rank with product-quantized database descriptors
+pq_subspaces = 8    # bytes per descriptor
+HAMMING = False     # short lists from Hamming embedding votes (ignores SCORING)
+he_bits = 32        # signature length, at most the descriptor dimension
+he_threshold = 12   # max Hamming distance between matching signatures
 
 
 def read_image_list(imlist_file):
     return [f.rstrip() for f in open(imlist_file)]
 
 
-def geometric_consistency(feat1, feat2):
-
-    if not GEO_CHECK:
-        return 0
-
-    kp1, desc1 = feat1['kp'], feat1['desc']
-    desc1 = pca_project(desc1, P, mu, pca_dim)
-
-    kp2, desc2 = feat2['kp'], feat2['desc']
-    desc2 = pca_project(desc2, P, mu, pca_dim)
-
-    # 1) matching de features
-    matcher = cv2.BFMatcher()
-    matches = matcher.match(np.float32(desc1), np.float32(desc2))
-    src = []
-    dst = []
-    for match in matches:
-        kp_im1 = kp1[match.queryIdx].flatten().take([0,1])
-        kp_im2 = kp2[match.trainIdx].flatten().take([0,1])
-        src.append(kp_im1), dst.append(kp_im2)
+def matching_features(fdict):
+    # keypoint coordinates + projected FLOAT descriptors, ready for matching
+    feat = {'xy': np.asarray(fdict['kp'], dtype=np.float32),
+            'desc': np.ascontiguousarray(pca_project(fdict['desc'], P, mu, pca_dim),
+                                         dtype=FLOAT)}
+    if MATCHING == 'words':
+        feat['words'] = vocabulary.assign(feat['desc'])
+    return feat
+
+
+def database_features(fname):
+    # matching features of a database image, with PQ codes in place of the
+    # descriptors if PQ_CODES
+    if not PQ_CODES:
+        return matching_features(store.get(fname))
+    fdict = code_store.get(fname)
+    feat = {'xy': np.asarray(fdict['kp'], dtype=np.float32),
+            'codes': np.array(fdict['desc'])}
+    if MATCHING == 'words':
+        feat['words'] = vocabulary.assign(pq.decode(feat['codes']))
+    return feat
+
+
+def stale_index(load, filename, image_list):
+    # document ids are positions in the image list: an index (loaded with
+    # load(filename)) is stale unless the list starts with the images it
+    # was built from, or if it is in an older format
+    try:
+        index = load(filename)
+    except IOError:
+        return True
+    return not (index.n_docs <= len(image_list) and
+                index.names_digest == digest(image_list[:index.n_docs]))
+
+
+def he_features(he, first):
+    # (doc_id, word, signature) of the database descriptors of the images
+    # image_list[first:], for the Hamming index
+    he_ids, he_words, he_sigs = [], [], []
+    for i, fname in enumerate(image_list[first:], first):
+        desc = store.get(fname)['desc']
+        if len(desc) == 0:
+            continue
+        desc = pca_project(desc, P, mu, pca_dim).reshape(len(desc), -1)
+        words = vocabulary.assign(desc)
+        he_ids.append(np.full(len(words), i, dtype=np.int32))
+        he_words.append(words)
+        he_sigs.append(he.signatures(desc, words))
+    if not he_ids:
+        return (np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int64),
+                np.zeros(0, dtype=np.uint64))
+    return np.concatenate(he_ids), np.concatenate(he_words), np.concatenate(he_sigs)
 
-    # src and dst are list of lists that contain 2 elements
-    model_robust, inliers = ransac((np.array(src), np.array(dst)), AffineTransform, min_samples=4,
-    residual_threshold=6, max_trials=350)
 
-    '''
+def query_matcher(feat):
+    # per-query matching state, shared by all the short list candidates
+    if MATCHING == 'words':
+        return QueryMatcher(feat['desc'], words=feat['words'])
+    return QueryMatcher(feat['desc'], ratio=0.8 if 'ratio' in MATCHING else None,
+                        mutual='mutual' in MATCHING, pq=pq)
 
-    2) Estimar una tranformación afín empleando RANSAC
-       a) armar una función que estime una transformación afin a partir de
-          correspondencias entre 3 pares de puntos (solución de mínimos
-          cuadrados en forma cerrada)
-       b) implementar RANSAC usando esa función como estimador base
-    3) contar y retornar número de inliers
-    '''
 
-    return sum(inliers)
+def geometric_consistency(matcher, feat1, feat2):
+    # feat1, feat2: as returned by matching_features; matcher: query_matcher(feat1)
 
+    if not GEO_CHECK:
+        return 0
 
-def pca_fit(samples):
-    _, ndim = samples.shape
+    xy1, xy2 = feat1['xy'], feat2['xy']
 
-    # 1) computar la media (mu) de las muestras de entrenamiento
-    mu = samples.mean(axis = 0)
+    # 1) matching de features
+    if MATCHING == 'words':
+        qi, di = matcher.match_words(feat2['words'])
+    elif 'codes' in feat2:
+        qi, di = matcher.match_codes(feat2['codes'])
+    else:
+        qi, di = matcher.match(feat2['desc'])
+    src, dst = xy1[qi], xy2[di]
 
-    # 2) computar matriz de covarianza
-    diffs = samples - mu
-    N = samples.shape[0]
-    covmat = np.dot(diffs.transpose(), diffs) / N
+    # 2) affine transform estimated with RANSAC (see affine.py)
+    model, inliers = ransac_affine(src, dst, threshold=6., max_trials=350)
 
-    # 3) computar autovectores y autovalores de la matriz de covarianza
-    eigvals, eigvects = np.linalg.eig(covmat)
+    # 3) number of inliers
+    return int(np.sum(inliers))
 
-    # 4) ordenar autovectores por valores decrecientes de los autovectores
-    indexes = np.argsort(eigvals).tolist()
-    indexes.reverse()
-    P = eigvects.transpose()[:, indexes]
 
-    return P.transpose(), mu
+def pca_fit(batches):
+    # media y covarianza acumuladas lote a lote (p.ej. leidos del feature
+    # store), autovectores ordenados por valores decrecientes de los
+    # autovalores (ver pca.py)
+    pca = PCA(n_components=None if PCA_METHOD == 'eigh' else pca_dim,
+              method=PCA_METHOD)
+    pca.fit(batches)
+    return pca.components, pca.mean
 
 
 # project vectors or entire datasets
@@ -131,7 +197,8 @@ def pca_project(x, P, mu, dim):
 
     if not pca_enabled:
         if NORM_L2:
-            x /= (np.linalg.norm(x, ord=2) + 1e-7)
+            # not in place, x may be a read-only slice of the feature store
+            x = x / (np.linalg.norm(x, ord=2) + 1e-7)
         return x
 
     reshaped = (x - mu)
@@ -145,6 +212,13 @@ def pca_project(x, P, mu, dim):
     return projection
 
 
+def load_vocabulary(filename):
+    # both vocabulary types provide assign(desc) and n_words
+    if VOCAB_TREE:
+        return VocabularyTree.load(filename)
+    return WordAssigner(load_data(filename))
+
+
 def intersect(count_db_i, count_qy):
     return sum(min(count_db_i, count_qy))
 
@@ -161,10 +235,16 @@ if __name__ == "__main__":
     unsup_image_list_file = 'image_list.txt'
 
     output_path = 'cache'
+    # every artifact is named after a hash of its parameters and inputs, so
+    # changing a parameter only recomputes the stages that depend on it
+    cache = ArtifactCache(output_path)
 
     # compute random samples
     n_samples = int(1e5)
-    unsup_samples_file = join(output_path, 'samples_{:d}.dat'.format(n_samples))
+    samples_params = dict(FEATURE_PARAMS, n_samples=n_samples, seed=12345,
+                          images=digest(read_image_list(unsup_image_list_file)))
+    samples_artifact = cache.artifact('samples', samples_params)
+    unsup_samples_file = samples_artifact.path
     if not exists(unsup_samples_file):
         unsup_samples = get_random_sample(read_image_list(unsup_image_list_file),
                                           unsup_base_path, n_samples=n_samples,
@@ -172,201 +252,293 @@ if __name__ == "__main__":
         save_data(unsup_samples, unsup_samples_file)
         print('{} saved'.format(unsup_samples_file))
 
-    # train PCA
-    pca_file = join(output_path, 'pca_{:d}.dat'.format(pca_dim))
-    samples = load_data(unsup_samples_file)
-    P, mu = pca_fit(samples)
+    # local features of the database images, also used to train the PCA
+    base_path = unsup_base_path
+    image_list = read_image_list(unsup_image_list_file)
+
+    # pre-compute local features, all of them in a single feature store
+    # (a single store per extraction setting, whatever the image list)
+    features_artifact = cache.artifact('features', FEATURE_PARAMS, ext='')
+    store = precompute_features(base_path, image_list, features_artifact.path, N_WORKERS)
+
+    # train PCA (once, then loaded from the cache) on descriptors streamed
+    # from the feature store, PCA_BATCH at a time
+    # (all the components are kept unless randomized, pca_dim only selects
+    # the leading ones in pca_project())
+    pca_params = {'method': PCA_METHOD, 'n_samples': n_samples,
+                  'batch': PCA_BATCH, 'seed': 12345, 'images': digest(image_list)}
+    if PCA_METHOD == 'randomized':
+        pca_params['pca_dim'] = pca_dim
+    pca_artifact = cache.artifact('pca', pca_params, deps=[features_artifact])
+    pca_file = pca_artifact.path
+    if not exists(pca_file):
+        batches = iter_feature_batches(store, image_list, PCA_BATCH,
+                                       random_state=np.random.RandomState(12345))
+        P, mu = pca_fit(islice(batches, -(-n_samples // PCA_BATCH)))
+        save_data({'P': P, 'mu': mu}, pca_file)
+        print('{} saved'.format(pca_file))
+    pca_model = load_data(pca_file)
+    P, mu = as_float(pca_model['P']), as_float(pca_model['mu'])
+
+    # what pca_project() does to the descriptors, for the downstream stages
+    projection = {'pca_enabled': pca_enabled, 'norm_l2': NORM_L2}
+    projection_deps = [samples_artifact]
+    if pca_enabled:
+        projection['pca_dim'] = pca_dim
+        projection_deps.append(pca_artifact)
 
     # compute vocabulary
     n_clusters = 1000
-    vocabulary_file = join(output_path, 'vocabulary_{:d}.dat'.format(n_clusters))
+    vocabulary_params = dict(projection, n_clusters=n_clusters,
+                             tree_depth=tree_depth if VOCAB_TREE else None)
+    vocabulary_artifact = cache.artifact('vocabulary', vocabulary_params,
+                                         deps=projection_deps)
+    vocabulary_file = vocabulary_artifact.path
     if not exists(vocabulary_file):
         samples = load_data(unsup_samples_file)
         # project samples to n_dim vectors
         # pr_samples = np.dot(P[:n_dim, :], (samples - mu).transpose())
         pr_samples = pca_project(samples, P, mu, pca_dim)
-        kmeans = KMeans(n_clusters=n_clusters, verbose=1, n_jobs=-2)
-        kmeans.fit(pr_samples)
-        save_data(kmeans.cluster_centers_, vocabulary_file)
+        if VOCAB_TREE:
+            branch_factor = int(round(n_clusters ** (1. / tree_depth)))
+            tree = VocabularyTree(branch_factor, tree_depth)
+            tree.fit(pr_samples, random_state=random_state)
+            tree.save(vocabulary_file)
+        else:
+            kmeans = KMeans(n_clusters=n_clusters, verbose=1, n_jobs=-2)
+            kmeans.fit(pr_samples)
+            save_data(kmeans.cluster_centers_, vocabulary_file)
         print('{} saved'.format(vocabulary_file))
 
+    # product quantizer for the re-ranking descriptors
+    pq = None
+    if PQ_CODES:
+        pq_artifact = cache.artifact('pq', dict(projection, n_subspaces=pq_subspaces),
+                                     deps=projection_deps)
+        pq_file = pq_artifact.path
+        if not exists(pq_file):
+            pq = ProductQuantizer(pq_subspaces)
+            pq.fit(pca_project(load_data(unsup_samples_file), P, mu, pca_dim),
+                   random_state=random_state, verbose=True)
+            pq.save(pq_file)
+            print('{} saved'.format(pq_file))
+        pq = ProductQuantizer.load(pq_file)
+
     # --------------
     # DBASE INDEXING
     # --------------
 
-    base_path = unsup_base_path
-    image_list = read_image_list(unsup_image_list_file)
-
-    # pre-compute local features
-    for fname in image_list:
-        imfile = join(base_path, fname)
-        featfile = join(output_path, splitext(fname)[0] + '.feat')
-        if exists(featfile):
-            continue
-        fdict = compute_features(imfile)
-        save_data(fdict, featfile)
-        print('{}: {} features'.format(featfile, len(fdict['desc'])))
+    # PQ codes of the database descriptors (n_subspaces bytes each instead
+    # of ndim floats) and their keypoint xy as float16 (half a pixel or
+    # better below 1024), all that re-ranking needs
+    if PQ_CODES:
+        codes_artifact = cache.artifact('pq_codes', {'kp': 'xy', 'kp_dtype': 'float16'},
+                                        deps=[features_artifact, pq_artifact], ext='')
+        code_store = FeatureStore(codes_artifact.path, ndim=pq_subspaces, dtype=np.uint8,
+                                  kp_dim=2, kp_dtype=np.float16)
+        for fname in image_list:
+            if fname not in code_store:
+                fdict = store.get(fname)
+                code_store.append(fname, pq.encode(pca_project(fdict['desc'], P, mu, pca_dim)),
+                                  fdict['kp'][:, :2])
 
     # compute inverted index
-    index_file = join(output_path, 'index_{:d}.dat'.format(n_clusters))
+    # (images appended to the list later are added to it, see below)
+    index_artifact = cache.artifact('index', projection,
+                                    deps=projection_deps + [features_artifact, vocabulary_artifact])
+    index_file = index_artifact.path
+    if exists(index_file) and stale_index(load_index, index_file, image_list):
+        print('{} was built from another image list, re-indexing'.format(index_file))
+        remove(index_file)
+    reindexed = not exists(index_file)
     if not exists(index_file):
-        vocabulary = load_data(vocabulary_file)
-        n_clusters, n_dim = vocabulary.shape
-
-        index = {
-            'n': 0,                                               # n documents
-            'df': np.zeros(n_clusters, dtype=int),                # doc. frec.
-            'dbase': dict([(k, []) for k in range(n_clusters)]),  # inv. file
-            'id2i': {},                                           # id->index
-            'norm': {},                                           # L2-norms
-            'nd': {}                                              # number of features per image
-        }
+        vocabulary = load_vocabulary(vocabulary_file)
+        n_words = vocabulary.n_words
 
         n_images = len(image_list)
 
-        for i, fname in enumerate(image_list):
-            imfile = join(base_path, fname)
-            imID = base64.encodestring(fname) # as int? / simlink to filepath?
-            if imID in index['id2i']:
-                continue
-            index['id2i'][imID] = i
+        # (doc_id, word, count) triplets of the inverted file + n features
+        post_ids, post_words, post_counts = [], [], []
+        nd = np.zeros(n_images, dtype=np.float32)
 
+        for i, fname in enumerate(image_list):
             # retrieve keypoints and local descriptors
-            ffile = join(output_path, splitext(fname)[0] + '.feat')
-            fdict = load_data(ffile)
+            fdict = store.get(fname)
             kp, desc = fdict['kp'], fdict['desc']
 
-            nd = len(desc)
-            if nd == 0:
+            if len(desc) == 0:
                 continue
+            nd[i] = len(desc)
 
             # project desc
             desc = pca_project(desc, P, mu, pca_dim)
-            dist2 = distance.cdist(desc, vocabulary, metric='sqeuclidean')
-            assignments = np.argmin(dist2, axis=1)
+            assignments = vocabulary.assign(desc)
             # idx and count are the bag of visual words - which visual words appear how many times in the image
             idx, count = np.unique(assignments, return_counts=True)
-            for j, c in zip(idx, count):
-                index['dbase'][j].append((imID, c))
-            index['n'] += 1
-            index['df'][idx] += 1 # increase one to all feature ids in idx.
-            #index['norm'][imID] = np.linalg.norm(count)
-            index['norm'][imID] = sum(abs(count))
-            index['nd'][imID] = float(nd)
+            post_ids.append(np.full(len(idx), i, dtype=np.int32))
+            post_words.append(idx)
+            post_counts.append(count)
 
             print('\rindexing {}/{}'.format(i+1, n_images), end='')
             sys.stdout.flush()
         print('')
 
-        save_index(index, index_file)
+        index = InvertedIndex.from_postings(n_words,
+                                            np.concatenate(post_ids),
+                                            np.concatenate(post_words),
+                                            np.concatenate(post_counts), nd)
+        index.names_digest = digest(image_list)
+
+        # a flat vocabulary is stored along the index
+        save_index(index, index_file,
+                   None if VOCAB_TREE else vocabulary.vocabulary)
         print('{} saved'.format(index_file))
 
     # ---------
     # RETRIEVAL
     # ---------
 
-    vocabulary = load_data(vocabulary_file)
-
     print('loading index ...', end=' ')
     sys.stdout.flush()
-    index = load_index(index_file)
+    index = IncrementalIndex(load_index(index_file), index_file)
     print('OK')
-    # number of documents / number of times the VW appears in any document(ignore a VW appearing multiple times)
-    idf = np.log(index['n'] / (index['df'] + 2**-23))
-
-    n_short_list = 100
+    if VOCAB_TREE:
+        vocabulary = load_vocabulary(vocabulary_file)
+    else:
+        vocabulary = WordAssigner(index.vocabulary)
+
+    # images appended to the list after the index was built are added to it
+    # (doc id == position in the image list), no need to re-index everything
+    n_new = len(image_list) - index.n_docs
+    if n_new > 0:
+        for fname in image_list[index.n_docs:]:
+            desc = store.get(fname)['desc']
+            if len(desc) > 0:
+                desc = pca_project(desc, P, mu, pca_dim)
+                index.add(vocabulary.assign(desc))
+            else:
+                index.add([])
+        index.names_digest = digest(image_list)
+        index.commit()
+        print('{} images added to {}'.format(n_new, index_file))
+    engine = index
+
+    # serve the index from N_SHARDS processes (shards split from the index)
+    if N_SHARDS > 1:
+        shard_files = [shard_filename(index_file, s, N_SHARDS) for s in range(N_SHARDS)]
+        if reindexed or n_new > 0 or not all(exists(f) for f in shard_files):
+            for shard, shard_file in zip(split_index(load_index(index_file), N_SHARDS),
+                                         shard_files):
+                save_index(shard, shard_file)
+        engine = ShardedIndex(shard_files)
+
+    # Hamming embedding: binary signature per database descriptor, kept in a
+    # separate index with one posting per descriptor
+    if HAMMING:
+        he_artifact = cache.artifact('hamming', dict(projection, n_bits=he_bits),
+                                     deps=projection_deps + [vocabulary_artifact])
+        he_file = he_artifact.path
+        he_index_file = cache.artifact('index_he', deps=[features_artifact, he_artifact]).path
+        if exists(he_index_file) and stale_index(HammingIndex.load, he_index_file, image_list):
+            print('{} was built from another image list, re-indexing'.format(he_index_file))
+            remove(he_index_file)
+        if not exists(he_index_file):
+            pr_samples = pca_project(load_data(unsup_samples_file), P, mu, pca_dim)
+            he = HammingEmbedding(he_bits)
+            he.fit(pr_samples, vocabulary.assign(pr_samples), vocabulary.n_words,
+                   random_state=random_state)
+            he.save(he_file)
+
+            he_index = HammingIndex.from_features(vocabulary.n_words, len(image_list),
+                                                  *he_features(he, 0))
+            he_index.names_digest = digest(image_list)
+            he_index.save(he_index_file)
+            print('{} saved'.format(he_index_file))
+        he = HammingEmbedding.load(he_file)
+        he_index = HammingIndex.load(he_index_file)
+
+        # images appended to the list, like in the inverted index above
+        if he_index.n_docs < len(image_list):
+            n_old = he_index.n_docs
+            he_index.add(len(image_list), *he_features(he, n_old))
+            he_index.names_digest = digest(image_list)
+            he_index.save(he_index_file)
+            print('{} images added to {}'.format(len(image_list) - n_old, he_index_file))
 
     score = []
 
     # images used to query, i goes [0, 4, 8, ..., 396]
     query_list = [image_list[i] for i in range(0, 4 * N_QUERY, 4)]
 
+    # query features and visual word assignments
+    query_feats, query_words = [], []
     for fname in query_list:
         imfile = join(base_path, fname)
 
         # compute low-level features
-        ffile = join(output_path, splitext(fname)[0] + '.feat')
-        if exists(ffile):
-            fdict = load_data(ffile)
+        if fname in store:
+            fdict = store.get(fname)
         else:
             fdict = compute_features(imfile)
-        kp, desc = fdict['kp'], fdict['desc']
 
         # project desc
-        desc = pca_project(desc, P, mu, pca_dim)
-        # get visual word assignments + counts
-        dist2 = distance.cdist(desc, vocabulary, metric='sqeuclidean')
-        assignments = np.argmin(dist2, axis=1)
-        idx_qy, count_qy = np.unique(assignments, return_counts=True)
-
-        # score ALL images using the (modified) dot-product with the query
-        scores = dict.fromkeys(index['id2i'], 0) # id-> score
-
-        # flat/cosine/IK similarities ------------------------------------------
-        # query_norm = np.linalg.norm(count_qy)
-        query_norm = sum(abs((count_qy)))
-        count_qy = count_qy.astype(np.float)  # otherwise =/ raises an exception
-        count_qy /= (query_norm + 2**-23)     # comment this line for flat scoring
-
-        for i, idx_qy_i in enumerate(idx_qy):  # for each VW in the query
-            inverted_list = index['dbase'][idx_qy_i]   # retrieve inv. list
-            for (img_id, count_db_i) in inverted_list:
-                # flat scores
-		        #scores[img_id] += 1
-                # cosine similarity = dot-prod. between l2-normalized BoVWs
-                # scores[img_id] += count_qy[i] * count_db_i / index['norm'][img_id]
-
-                # intersection kernel
-                scores[img_id] += min(count_qy[i], float(count_db_i) / index['norm'][img_id])
-
-            # tf-idf ---------------------------------------------------------------
-
-        #tf_idf_qy = idf[idx_qy] * count_qy / float(len(desc))
-        #tf_idf_qy /= (np.linalg.norm(tf_idf_qy) + 2**-23)
-
-        #tf_idf_db_norm = dict.fromkeys(index['id2i'], 0)
-
-        #for i, idx_qy_i in enumerate(idx_qy):
-        #    inverted_list = index['dbase'][idx_qy_i]
-        #    for (img_id, count_db_i) in inverted_list:
-        #        tf_idf_db_i = idf[idx_qy_i] * count_db_i / index['nd'][img_id]
-        #        tf_idf_db_norm[img_id] += tf_idf_db_i ** 2.0
-        #        scores[img_id] += tf_idf_qy[i] * tf_idf_db_i
-
-        #for img_id in scores.keys():
-        #    scores[img_id] /= np.sqrt(tf_idf_db_norm[img_id] + 2**-23)
-
-        # ----------------------------------------------------------------------
-
-        # rank list
-        short_list = sorted(scores.items(), key=lambda x: x[1], reverse=True)[:n_short_list]
-
-        # spatial re-ranking
-        fdict1 = fdict
-        scores = []
-        for id_, _ in short_list:
-            i = index['id2i'][id_]
-            ffile2 = join(output_path, splitext(image_list[i])[0] + '.feat')
-            fdict2 = load_data(ffile2)
-            consistency_score = geometric_consistency(fdict1, fdict2)
-            scores.append(consistency_score)
-
-        # re-rank short list
-        if np.sum(scores) > 0.0:
-            idxs = np.argsort(-np.array(scores))
-            short_list = [short_list[i] for i in idxs]
-
-        # get index from file name
-        n = int(splitext(fname)[0][-5:])
-
-        # compute score for query + print output
-        tp = 0
-        print('Q: {}'.format(image_list[n]))
-        for id_, s in short_list[:4]:
-            i = index['id2i'][id_]
-            tp += int((i//4) == (n//4))
-            print('  {:.3f} {}'.format(s, image_list[i]))
-        print('  hits = {}'.format(tp))
-        score.append(tp)
+        fdict = matching_features(fdict)
+        # get visual word assignments
+        query_feats.append(fdict)
+        if 'words' not in fdict:
+            fdict['words'] = vocabulary.assign(fdict['desc'])
+        query_words.append(fdict['words'])
+
+    # score ALL images against ALL the query BoVWs (see SCORING, HAMMING) + rank lists
+    if HAMMING:
+        query_sigs = [he.signatures(f['desc'], w) for f, w in zip(query_feats, query_words)]
+        ranking, ranking_scores = he_index.search(query_words, query_sigs,
+                                                  N_SHORT_LIST, he_threshold)
+    else:
+        Q = bovw_matrix(query_words, index.n_words)
+        ranking, ranking_scores = engine.search(Q, N_SHORT_LIST, mode=SCORING)
+    if N_SHARDS > 1:
+        engine.close()
+
+    rerank_pool = ThreadPool(RERANK_WORKERS) if RERANK_WORKERS > 1 else None
+
+    # database features for re-ranking, loaded and projected once per image
+    feature_cache = FeatureCache(lambda i: database_features(image_list[i]),
+                                 max_bytes=FEATURE_CACHE_MB * 2**20)
+
+    try:
+        for q, fname in enumerate(query_list):
+            short_list = list(zip(ranking[q], ranking_scores[q]))
+
+            # spatial re-ranking, candidates fetched and checked in parallel
+            # (fetching counts against the time budget)
+            fdict1 = query_feats[q]
+            matcher = query_matcher(fdict1)
+            scores = rerank_scores(lambda i: geometric_consistency(matcher, fdict1,
+                                                                   feature_cache.get(i)),
+                                   [i for i, _ in short_list], rerank_pool, RERANK_BUDGET)
+
+            # re-rank short list (unchecked candidates keep their order at the end)
+            if np.nansum(scores) > 0.0:
+                idxs = rerank_order(scores)
+                short_list = [short_list[i] for i in idxs]
+
+            # get index from file name
+            n = int(splitext(fname)[0][-5:])
+
+            # compute score for query + print output
+            tp = 0
+            print('Q: {}'.format(image_list[n]))
+            for i, s in short_list[:4]:
+                tp += int((i//4) == (n//4))
+                print('  {:.3f} {}'.format(s, image_list[i]))
+            print('  hits = {}'.format(tp))
+            score.append(tp)
+    finally:
+        if rerank_pool is not None:
+            rerank_pool.close()
+            rerank_pool.join()
 
     print('retrieval score = {:.2f}'.format(np.mean(score)))
+    print('feature cache: {hits} hits, {misses} misses, {evictions} evictions, '
+          '{bytes} bytes'.format(**feature_cache.stats))
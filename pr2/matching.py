@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+from __future__ import division
+
+import sys
+from os.path import join, split, abspath
+
+import numpy as np
+
+from pq import ProductQuantizer
+
+sys.path.append(join(split(abspath(__file__))[0], '..', 'common'))
+from dtypes import FLOAT
+
+
+def _sorted_words(words):
+    # features grouped by visual word: order, distinct words, first position
+    # of every word in the order and number of features per word
+    order = np.argsort(words, kind='mergesort')
+    uniq, start, count = np.unique(words[order], return_index=True,
+                                   return_counts=True)
+    return order, uniq, start, count
+
+
+class QueryMatcher(object):
+    '''Tentative matches between the features of a query and those of the
+    database images in its short list.
+
+    Everything that only depends on the query (FLOAT descriptors and their
+    squared norms, features grouped by visual word) is computed once.
+    Descriptor matching keeps nearest neighbours that pass Lowe's ratio test
+    (ratio=None disables it) and/or are mutual nearest neighbours; word
+    matching pairs features assigned to the same visual word.
+    '''
+
+    def __init__(self, desc, words=None, ratio=0.8, mutual=False,
+                 max_per_word=1, pq=None):
+        self.desc = np.ascontiguousarray(desc, dtype=FLOAT)
+        self.sq_norms = np.einsum('ij,ij->i', self.desc, self.desc)
+        self.ratio = ratio
+        self.mutual = mutual
+        self.max_per_word = max_per_word
+        self._words = None if words is None else _sorted_words(np.asarray(words))
+        # ADC lookup tables, to match against product-quantized descriptors
+        self.tables = None if pq is None else pq.distance_tables(self.desc)
+
+    def match(self, desc):
+        '''Indices (query, database) of the matching features.'''
+        desc = np.asarray(desc, dtype=FLOAT)
+        if len(self.desc) == 0 or len(desc) == 0:
+            return np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.intp)
+
+        # (n_q x n_db) squared distances from a single GEMM
+        dist2 = np.dot(self.desc, desc.T)
+        dist2 *= -2
+        dist2 += self.sq_norms[:, None]
+        dist2 += np.einsum('ij,ij->i', desc, desc)[None, :]
+        return self._select(dist2)
+
+    def match_codes(self, codes):
+        '''match() for database descriptors given as PQ codes, with squared
+        distances read from the lookup tables.'''
+        if self.tables is None:
+            raise ValueError('query built without a product quantizer')
+        if len(self.desc) == 0 or len(codes) == 0:
+            return np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.intp)
+        return self._select(ProductQuantizer.adc(self.tables, codes))
+
+    def _select(self, dist2):
+        # nearest neighbours that pass the ratio and/or mutual tests
+        n_q, n_db = dist2.shape
+        nn = np.argmin(dist2, axis=1)
+        keep = np.ones(n_q, dtype=bool)
+
+        if self.ratio is not None and n_db > 1:
+            # ratio test on distances == ratio**2 test on squared distances
+            two = np.partition(dist2, 1, axis=1)[:, :2]
+            keep &= two[:, 0] < (self.ratio ** 2) * two[:, 1]
+
+        if self.mutual:
+            keep &= np.argmin(dist2, axis=0)[nn] == np.arange(n_q)
+
+        qi = np.where(keep)[0]
+        return qi, nn[qi]
+
+    def match_words(self, words):
+        '''Pairs of features that share a visual word, skipping words that
+        appear more than max_per_word times in either image (bursts).'''
+        if self._words is None:
+            raise ValueError('query built without word assignments')
+        q_order, q_uniq, q_start, q_count = self._words
+        db_order, db_uniq, db_start, db_count = _sorted_words(np.asarray(words))
+
+        _, iq, idb = np.intersect1d(q_uniq, db_uniq, assume_unique=True,
+                                    return_indices=True)
+        keep = (q_count[iq] <= self.max_per_word) & (db_count[idb] <= self.max_per_word)
+        iq, idb = iq[keep], idb[keep]
+
+        # all the (query, database) pairs of every shared word
+        n_q, n_db = q_count[iq], db_count[idb]
+        n_pairs = n_q * n_db
+        w = np.repeat(np.arange(len(iq)), n_pairs)
+        k = np.arange(n_pairs.sum()) - np.repeat(np.cumsum(n_pairs) - n_pairs, n_pairs)
+        qi = q_order[q_start[iq][w] + k // n_db[w]]
+        di = db_order[db_start[idb][w] + k % n_db[w]]
+        return qi, di
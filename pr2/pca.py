@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+'''PCA trained from streamed chunks of descriptors.
+
+Only the running mean and scatter matrix (ndim x ndim) are kept while the
+chunks are read, merged chunk by chunk with the pairwise update of Chan et
+al., so the number of training descriptors is not bounded by memory. The
+components are then the top eigenvectors of the covariance, obtained with a
+full symmetric eigensolver or, for large ndim and few components, with a
+randomized subspace iteration (Halko, Martinsson & Tropp, 2011).
+'''
+from __future__ import print_function
+from __future__ import division
+
+import sys
+from os.path import join, split, abspath
+
+import numpy as np
+
+sys.path.append(join(split(abspath(__file__))[0], '..', 'common'))
+from dtypes import as_float
+
+
+def randomized_eigh(C, k, n_oversamples=10, n_iter=4, random_state=None):
+    '''Approximate top-k eigenpairs (decreasing eigenvalues) of the
+    symmetric positive semi-definite matrix C.'''
+    if random_state is None:
+        random_state = np.random.RandomState()
+    n = C.shape[0]
+    Q = random_state.randn(n, min(n, k + n_oversamples))
+    for _ in range(n_iter + 1):
+        # orthonormalize at every step so small eigenvalues are not lost
+        Q, _ = np.linalg.qr(np.dot(C, Q))
+    eigvals, V = np.linalg.eigh(np.dot(Q.T, np.dot(C, Q)))
+    order = np.argsort(eigvals)[::-1][:k]
+    return eigvals[order], np.dot(Q, V[:, order])
+
+
+class PCA(object):
+    '''method='eigh' computes all the components, 'randomized' only the top
+    n_components (n_components=None keeps them all).'''
+
+    def __init__(self, n_components=None, method='eigh', random_state=None):
+        if method not in ('eigh', 'randomized'):
+            raise ValueError('unknown PCA method: {}'.format(method))
+        self.n_components = n_components
+        self.method = method
+        self.random_state = random_state
+
+        self.n_samples = 0
+        self._mean = None
+        self._scatter = None
+        self.components = None   # (ndim x n_components), by decreasing variance
+        self.mean = None
+        self.explained_variance = None
+
+    def partial_fit(self, X):
+        '''Accumulate the statistics of a chunk of samples.'''
+        X = np.asarray(X, dtype=np.float64)
+        n_b = len(X)
+        if n_b == 0:
+            return self
+        mean_b = X.mean(axis=0)
+        diffs = X - mean_b
+        scatter_b = np.dot(diffs.T, diffs)
+
+        if self.n_samples == 0:
+            self._mean, self._scatter = mean_b, scatter_b
+        else:
+            n_a = self.n_samples
+            delta = mean_b - self._mean
+            self._scatter += scatter_b + np.outer(delta, delta) * (n_a * n_b / (n_a + n_b))
+            self._mean += delta * (n_b / (n_a + n_b))
+        self.n_samples += n_b
+        return self
+
+    def fit(self, chunks):
+        '''Fit from an iterable of sample chunks (or a single array).'''
+        if isinstance(chunks, np.ndarray):
+            chunks = [chunks]
+        for X in chunks:
+            self.partial_fit(X)
+        return self.finalize()
+
+    def finalize(self):
+        '''Compute the components from the accumulated statistics.'''
+        cov = self._scatter / self.n_samples
+        ndim = len(cov)
+        k = ndim if self.n_components is None else min(self.n_components, ndim)
+        if self.method == 'randomized':
+            eigvals, eigvects = randomized_eigh(cov, k, random_state=self.random_state)
+        else:
+            eigvals, eigvects = np.linalg.eigh(cov)
+            eigvals, eigvects = eigvals[::-1][:k], eigvects[:, ::-1][:, :k]
+        self.components = as_float(eigvects)
+        self.mean = as_float(self._mean)
+        self.explained_variance = eigvals
+        return self
+
+    def transform(self, X, dim=None):
+        return np.dot(as_float(X) - self.mean, self.components[:, :dim])
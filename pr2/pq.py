@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+'''Product quantization of local descriptors.
+
+Jegou, H., Douze, M., & Schmid, C. (2011). Product quantization for nearest
+neighbor search. IEEE TPAMI, 33(1), 117-128.
+
+Descriptors are split into n_subspaces chunks, each one encoded as the index
+(one byte) of its nearest centroid in a per-chunk codebook. Distances between
+a raw query descriptor and encoded database descriptors are sums of
+per-chunk lookup tables (asymmetric distance computation, ADC).
+'''
+from __future__ import print_function
+from __future__ import division
+
+import sys
+from os.path import join, split, abspath
+
+import numpy as np
+
+sys.path.append(join(split(abspath(__file__))[0], '..', 'common'))
+from assignment import WordAssigner
+from kmeans import kmeans_fit
+
+
+class ProductQuantizer(object):
+    '''n_subspaces x n_centroids codebooks; codes are (n x n_subspaces)
+    uint8 arrays, i.e. n_subspaces bytes per descriptor.'''
+
+    def __init__(self, n_subspaces=8, n_centroids=256):
+        if n_centroids > 256:
+            raise ValueError('codes are single bytes, n_centroids <= 256')
+        self.n_subspaces = n_subspaces
+        self.n_centroids = n_centroids
+        self.codebooks = np.zeros((n_subspaces, n_centroids, 0), dtype=np.float32)
+
+    @property
+    def ndim(self):
+        return self.n_subspaces * self.codebooks.shape[2]
+
+    def _split(self, X):
+        X = np.atleast_2d(np.asarray(X, dtype=np.float32))
+        if X.shape[1] % self.n_subspaces != 0:
+            raise ValueError('descriptor dimension {} not a multiple of {}'.format(
+                X.shape[1], self.n_subspaces))
+        # (n_subspaces, n, ndim / n_subspaces)
+        return X.reshape(len(X), self.n_subspaces, -1).transpose(1, 0, 2)
+
+    def fit(self, samples, n_iter=20, random_state=None, verbose=False):
+        if random_state is None:
+            random_state = np.random.RandomState()
+        chunks = self._split(samples).astype(np.float64)
+        self.codebooks = np.stack([kmeans_fit(c, self.n_centroids, maxiter=n_iter,
+                                              random_state=random_state, verbose=False)
+                                   for c in chunks]).astype(np.float32)
+        if verbose:
+            err = np.mean(np.sum((self.decode(self.encode(samples)) - samples) ** 2, axis=1))
+            print('PQ {}x{}: mean squared error {:.4f}'.format(
+                self.n_subspaces, self.n_centroids, err))
+        return self
+
+    def encode(self, X):
+        X = np.atleast_2d(X)
+        codes = [WordAssigner(cb).assign(c) for cb, c in zip(self.codebooks, self._split(X))]
+        if len(codes) == 0 or len(X) == 0:
+            return np.zeros((len(X), self.n_subspaces), dtype=np.uint8)
+        return np.column_stack(codes).astype(np.uint8)
+
+    def decode(self, codes):
+        codes = np.asarray(codes, dtype=np.intp)
+        return np.concatenate([cb[codes[:, j]] for j, cb in enumerate(self.codebooks)],
+                              axis=1)
+
+    def distance_tables(self, Q):
+        '''(n_q, n_subspaces, n_centroids) squared distances between the
+        chunks of the raw descriptors Q and the centroids.'''
+        tables = [np.sum((c[:, None, :] - cb[None, :, :]) ** 2, axis=2)
+                  for cb, c in zip(self.codebooks, self._split(Q))]
+        return np.stack(tables, axis=1)
+
+    @staticmethod
+    def adc(tables, codes):
+        '''(n_q, n_db) squared distances between the query descriptors of the
+        tables and the encoded database descriptors.'''
+        codes = np.asarray(codes, dtype=np.intp)
+        dist2 = np.zeros((tables.shape[0], len(codes)), dtype=np.float32)
+        for j in range(tables.shape[1]):
+            dist2 += tables[:, j, :][:, codes[:, j]]
+        return dist2
+
+    def save(self, filename):
+        with open(filename, 'wb') as fh:
+            np.savez(fh, codebooks=self.codebooks)
+
+    @classmethod
+    def load(cls, filename):
+        with open(filename, 'rb') as fh:
+            codebooks = np.load(fh)['codebooks']
+        pq = cls(codebooks.shape[0], codebooks.shape[1])
+        pq.codebooks = codebooks
+        return pq
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+from __future__ import division
+
+import time
+
+import numpy as np
+
+
+def rerank_scores(check, candidates, pool=None, time_budget=None, clock=time.time):
+    '''Consistency score check(c) of every short list candidate c (e.g. an
+    image id, check() fetching its features, so that fetching is parallel
+    and within the budget too).
+
+    Candidates are fanned out to pool (e.g. a multiprocessing.pool.ThreadPool;
+    matching and RANSAC spend most of their time in GIL-releasing NumPy
+    calls) in short list order. Once time_budget seconds have passed, the
+    remaining candidates are skipped and get a NaN score (as measured by
+    clock(), in seconds). Scores are returned in candidate order.
+    '''
+    deadline = None if time_budget is None else clock() + time_budget
+
+    def task(candidate):
+        if deadline is not None and clock() > deadline:
+            return np.nan
+        return check(candidate)
+
+    if pool is None:
+        scores = [task(c) for c in candidates]
+    else:
+        scores = pool.map(task, candidates, chunksize=1)
+    return np.array(scores, dtype=np.float64)
+
+
+def rerank_order(scores):
+    '''New short list order: checked candidates by decreasing score (ties keep
+    their short list order), then the unchecked (NaN) ones as they were.'''
+    scores = np.asarray(scores, dtype=np.float64)
+    checked = np.where(~np.isnan(scores))[0]
+    unchecked = np.where(np.isnan(scores))[0]
+    checked = checked[np.argsort(-scores[checked], kind='mergesort')]
+    return np.concatenate((checked, unchecked))
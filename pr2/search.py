@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+from __future__ import division
+
+import sys
+from os.path import join, split, abspath
+
+import numpy as np
+
+from scipy import sparse
+
+sys.path.append(join(split(abspath(__file__))[0], '..', 'common'))
+from dtypes import FLOAT
+from kernel_maps import ADDITIVE
+
+SCORING_MODES = ('flat', 'cosine', 'tfidf', 'intersection', 'chi2', 'hellinger')
+
+
+def bovw_matrix(assignments, n_words):
+    '''Stack the word assignments of several images into a sparse
+    (n_images x n_words) matrix of word counts.'''
+    rows = np.repeat(np.arange(len(assignments)), [len(a) for a in assignments])
+    cols = np.concatenate([np.asarray(a, dtype=np.int64) for a in assignments])
+    counts = np.ones(len(cols), dtype=FLOAT)
+    # duplicated (row, col) entries are summed up on conversion
+    return sparse.coo_matrix((counts, (rows, cols)),
+                             shape=(len(assignments), n_words)).tocsr()
+
+
+def top_k(scores, k):
+    '''Indices of the k largest scores along the last axis, sorted by
+    decreasing score.
+
+    Uses a partial selection (O(n) per row) and only sorts the k selected
+    entries, instead of sorting the whole score vector.
+    '''
+    scores = np.asarray(scores)
+    n = scores.shape[-1]
+    k = min(k, n)
+    if k <= 0:
+        return np.zeros(scores.shape[:-1] + (0,), dtype=np.intp)
+
+    if k < n:
+        ids = np.argpartition(-scores, k - 1, axis=-1)[..., :k]
+    else:
+        ids = np.broadcast_to(np.arange(n), scores.shape)
+    order = np.argsort(-np.take_along_axis(scores, ids, axis=-1), axis=-1,
+                       kind='mergesort')
+    return np.take_along_axis(ids, order, axis=-1)
+
+
+def _row_normalize(X, ord):
+    X = sparse.csr_matrix(X, dtype=FLOAT, copy=True)
+    if ord == 1:
+        nrm = np.asarray(abs(X).sum(axis=1)).ravel()
+    else:
+        nrm = np.sqrt(np.asarray(X.multiply(X).sum(axis=1)).ravel())
+    X.data /= np.repeat(nrm + 2**-23, np.diff(X.indptr)).astype(FLOAT)
+    return X
+
+
+class QueryEngine(object):
+    '''Scores a batch of query BoVWs against an InvertedIndex.
+
+    Scores are accumulated over the posting lists of the query words with
+    one bincount per batch of queries, reading the index arrays as they are
+    stored (memory maps are not copied). The document side normalization of
+    the cosine, tf-idf and Hellinger scores factors out of the sums and is
+    applied to the scores, the idf weights of tf-idf are moved to the query
+    side. The intersection and chi2 additive kernels between L1-normalized
+    BoVWs are accumulated word by word. Queries are processed in batches so
+    that dense intermediate matrices hold at most `max_cells` entries.
+    '''
+
+    def __init__(self, index, max_cells=2**24):
+        self.index = index
+        self.max_cells = max_cells
+        self.idf = index.idf
+        self._dbase = {}    # mode -> per-document score factor
+
+    def set_idf(self, idf):
+        '''Score with other idf weights, e.g. those of a collection the index
+        is only a segment of.'''
+        if not np.array_equal(idf, self.idf):
+            self.idf = idf
+            self._dbase.pop('tfidf', None)
+
+    def _doc_scale(self, mode):
+        # 1 / norm of every document vector (n_docs entries, the only thing
+        # cached); the temporaries below are dropped once it is computed
+        if mode in self._dbase:
+            return self._dbase[mode]
+
+        index = self.index
+        if mode == 'hellinger':
+            # sqrt(count / norm) = sqrt(count) / sqrt(norm)
+            nrm = np.sqrt(index.norm, dtype=np.float64)
+        else:
+            nrm2 = np.square(index.weights, dtype=np.float64)
+            if mode == 'tfidf':
+                nrm2 *= np.repeat(np.square(self.idf, dtype=np.float64),
+                                  np.diff(index.offsets))
+            nrm = np.sqrt(np.bincount(index.doc_ids, weights=nrm2,
+                                      minlength=index.n_docs))
+        scale = 1. / (nrm + 2**-23)
+        self._dbase[mode] = scale
+        return scale
+
+    def _posting_scores(self, Q, transform=None, scale=None):
+        # scores of the query rows of Q: sum over the query words of the
+        # query weight times the (transformed) posting weight
+        index = self.index
+        n_queries = Q.shape[0]
+        rows = np.repeat(np.arange(n_queries), np.diff(Q.indptr))
+        pos, doc_ids, weights = index.postings(Q.indices)
+        if transform is not None:
+            weights = transform(weights)
+        S = np.bincount(rows[pos] * index.n_docs + doc_ids,
+                        weights=Q.data[pos] * weights,
+                        minlength=n_queries * index.n_docs)
+        S = S.reshape(n_queries, index.n_docs)
+        if scale is not None:
+            S *= scale
+        return S.astype(FLOAT)
+
+    def scores(self, Q, mode='cosine'):
+        '''Dense (n_queries x n_docs) score matrix for the query BoVWs in Q.'''
+        if mode not in SCORING_MODES:
+            raise ValueError('unknown scoring mode: {}'.format(mode))
+
+        Q = sparse.csr_matrix(Q, dtype=FLOAT)
+        if mode in ('intersection', 'chi2'):
+            return self._additive_scores(Q, mode)
+
+        transform, scale = None, None
+        if mode == 'flat':
+            Q = Q.copy()
+            Q.data[:] = 1.
+            transform = np.ones_like
+        elif mode == 'cosine':
+            Q = _row_normalize(Q, 2)
+        elif mode == 'tfidf':
+            idf = self.idf.reshape(1, -1)
+            Q = sparse.csr_matrix(_row_normalize(Q.multiply(idf), 2).multiply(idf))
+        elif mode == 'hellinger':
+            Q = _row_normalize(Q, 1).sqrt()
+            transform = np.sqrt
+        if mode != 'flat':
+            scale = self._doc_scale(mode)
+
+        batch = max(1, self.max_cells // max(self.index.n_docs, 1))
+        scores = [self._posting_scores(Q[i:i + batch], transform, scale)
+                  for i in range(0, Q.shape[0], batch)]
+        return np.concatenate(scores, axis=0)
+
+    def _additive_scores(self, Q, kernel):
+        # additive kernel between L1-normalized BoVWs; k(q, d) is not a
+        # dot-product, so the posting list of every word is compared against
+        # all the queries containing it (only non-zero query entries count,
+        # k(0, d) = 0 for both kernels)
+        index = self.index
+        k = ADDITIVE[kernel]
+
+        Q = _row_normalize(Q, 1)
+        batch = max(1, self.max_cells // max(index.n_docs, 1))
+        scores = []
+        for i in range(0, Q.shape[0], batch):
+            Qb = Q[i:i + batch].tocsc()
+            S = np.zeros((index.n_docs, Qb.shape[0]), dtype=FLOAT)
+            for w in np.nonzero(np.diff(Qb.indptr))[0]:
+                start, stop = index.offsets[w], index.offsets[w + 1]
+                qy = slice(Qb.indptr[w], Qb.indptr[w + 1])
+                doc_ids = index.doc_ids[start:stop]
+                count_db = index.weights[start:stop] / index.norm[doc_ids]
+                S[doc_ids[:, None], Qb.indices[qy]] += \
+                    k(count_db[:, None], Qb.data[qy])
+            scores.append(S.T)
+        return np.concatenate(scores, axis=0)
+
+    def search(self, Q, k, mode='cosine'):
+        '''Top-k documents for every query; returns (ids, scores), both of
+        shape (n_queries x k) and sorted by decreasing score.'''
+        scores = self.scores(Q, mode)
+        ids = top_k(scores, k)
+        return ids, np.take_along_axis(scores, ids, axis=1)
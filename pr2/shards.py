@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+'''Inverted index split into shards, searched by scatter-gather.
+
+Image doc_id goes to shard doc_id % n_shards, where it has the local id
+doc_id // n_shards. Every shard is a regular InvertedIndex file (its idf
+being that of the whole collection), so it can be built, saved and served
+on its own; a ShardedIndex sends each batch of queries to all the shards,
+served from separate processes, and merges their top-k lists.
+'''
+from __future__ import print_function
+from __future__ import division
+
+import traceback
+from multiprocessing import Pipe, Process
+
+import numpy as np
+
+from inverted_index import InvertedIndex
+from search import QueryEngine, top_k
+
+
+def shard_filename(filename, shard, n_shards):
+    return '{}.shard{:d}of{:d}'.format(filename, shard, n_shards)
+
+
+def build_shards(n_words, doc_ids, words, counts, nd, n_shards):
+    '''InvertedIndex.from_postings(), one index per shard.'''
+    doc_ids = np.asarray(doc_ids, dtype=np.int64)
+    words = np.asarray(words, dtype=np.int64)
+    counts = np.asarray(counts, dtype=np.float32)
+    nd = np.asarray(nd, dtype=np.float32)
+
+    # idf of the whole collection
+    n = len(np.unique(doc_ids[counts > 0]))
+    df = np.bincount(words, minlength=n_words)
+    idf = np.log(n / (df + 2**-23)).astype(np.float32)
+
+    shards = []
+    for s in range(n_shards):
+        sel = doc_ids % n_shards == s
+        shard = InvertedIndex.from_postings(n_words, doc_ids[sel] // n_shards,
+                                            words[sel], counts[sel],
+                                            nd[s::n_shards])
+        shard.idf = idf
+        shards.append(shard)
+    return shards
+
+
+def split_index(index, n_shards):
+    '''Shards of an existing InvertedIndex.'''
+    words = np.repeat(np.arange(index.n_words), np.diff(index.offsets))
+    return build_shards(index.n_words, index.doc_ids, words, index.weights,
+                        index.nd, n_shards)
+
+
+def _serve(filename, conn):
+    # shard server: answers (Q, k, mode) requests until it gets None
+    engine = QueryEngine(InvertedIndex.load(filename))
+    while True:
+        request = conn.recv()
+        if request is None:
+            break
+        try:
+            conn.send(engine.search(*request))
+        except Exception:
+            conn.send(RuntimeError(traceback.format_exc()))
+    conn.close()
+
+
+class ShardedIndex(object):
+    '''Coordinator of the shard servers, with the QueryEngine.search()
+    interface. Shards are served from one process each (processes=False
+    searches them one after the other in this process instead).'''
+
+    def __init__(self, filenames, processes=True):
+        self.n_shards = len(filenames)
+        self._conns, self._procs, self._engines = [], [], []
+        for filename in filenames:
+            if processes:
+                conn, child_conn = Pipe()
+                proc = Process(target=_serve, args=(filename, child_conn))
+                proc.daemon = True
+                proc.start()
+                self._conns.append(conn)
+                self._procs.append(proc)
+            else:
+                self._engines.append(QueryEngine(InvertedIndex.load(filename)))
+
+    def search(self, Q, k, mode='cosine'):
+        '''Top-k documents for every query, over all the shards; returns
+        (ids, scores) with global document ids.'''
+        # scatter, then gather: all the shards work at the same time
+        for conn in self._conns:
+            conn.send((Q, k, mode))
+        if self._conns:
+            results = [conn.recv() for conn in self._conns]
+        else:
+            results = [engine.search(Q, k, mode) for engine in self._engines]
+        for r in results:
+            if isinstance(r, Exception):
+                raise r
+
+        ids = np.concatenate([local_ids * self.n_shards + s
+                              for s, (local_ids, _) in enumerate(results)], axis=1)
+        scores = np.concatenate([s for _, s in results], axis=1)
+        best = top_k(scores, k)
+        return (np.take_along_axis(ids, best, axis=1),
+                np.take_along_axis(scores, best, axis=1))
+
+    def close(self):
+        for conn in self._conns:
+            conn.send(None)
+            conn.close()
+        for proc in self._procs:
+            proc.join()
+        self._conns, self._procs, self._engines = [], [], []
@@ -0,0 +1,28 @@
+from affine import apply_affine, estimate_affine, ransac_affine
+import numpy as np
+
+random_state = np.random.RandomState(0)
+M = np.array([[0.9, -0.2], [0.25, 1.1], [20., -10.]])
+
+# exact fit
+src = random_state.rand(10, 2) * 500
+dst = apply_affine(M, src)
+assert(np.allclose(estimate_affine(src, dst), M))
+
+# 60% outliers
+n, n_in = 200, 80
+src = random_state.rand(n, 2) * 500
+dst = random_state.rand(n, 2) * 500
+dst[:n_in] = apply_affine(M, src[:n_in]) + random_state.randn(n_in, 2)
+M_hat, inliers = ransac_affine(src, dst, threshold=6., max_trials=1000,
+                               random_state=random_state)
+assert(np.allclose(M_hat, M, atol=0.05 * np.abs(M).max()))
+assert(np.all(inliers[:n_in]))
+assert(inliers[n_in:].sum() < 5)
+
+# not enough / degenerate correspondences
+M_hat, inliers = ransac_affine(src[:2], dst[:2])
+assert(M_hat is None and len(inliers) == 2)
+line = np.column_stack((np.arange(10.), np.arange(10.)))
+M_hat, inliers = ransac_affine(line, line)
+assert(M_hat is None and not np.any(inliers))
@@ -0,0 +1,50 @@
+from feature_cache import FeatureCache
+import numpy as np
+
+loads = []
+def loader(image_id):
+    loads.append(image_id)
+    return {'xy': np.zeros((10, 2), dtype=np.float32),   # 80 bytes
+            'desc': np.zeros((10, 4), dtype=np.float32)} # 160 bytes
+
+cache = FeatureCache(loader, max_bytes=3 * 240)
+for image_id in [0, 1, 2, 0, 3, 1]:
+    cache.get(image_id)
+
+# room for 3: loading 3 evicts 1 (0 was used more recently), then
+# reloading 1 evicts 2
+assert(loads == [0, 1, 2, 3, 1])
+assert(cache.stats['hits'] == 1 and cache.stats['misses'] == 5)
+assert(cache.stats['evictions'] == 2)
+assert(len(cache) == 3 and cache.nbytes == 3 * 240)
+assert(2 not in cache and 0 in cache and 1 in cache and 3 in cache)
+
+cache = FeatureCache(loader, max_items=1)
+cache.get(0), cache.get(1)
+assert(len(cache) == 1 and 1 in cache)
+
+# memory-mapped arrays are copied, their bytes are resident in the cache
+import os
+import tempfile
+mm_file = os.path.join(tempfile.mkdtemp(), 'desc.bin')
+np.arange(40, dtype=np.float32).tofile(mm_file)
+desc = np.memmap(mm_file, dtype=np.float32, mode='r', shape=(10, 4))
+cache = FeatureCache(lambda i: {'desc': desc[i:i + 2]})
+item = cache.get(3)
+assert(not isinstance(item['desc'], np.memmap) and item['desc'].flags.owndata)
+assert(np.array_equal(item['desc'], desc[3:5]) and cache.nbytes == 32)
+del desc
+os.remove(mm_file)
+
+# concurrent gets from a thread pool: every image is loaded once when the
+# requests do not overlap, and the byte count stays consistent
+from multiprocessing.pool import ThreadPool
+loads = []
+cache = FeatureCache(loader, max_bytes=5 * 240)
+pool = ThreadPool(4)
+pool.map(cache.get, list(range(20)), chunksize=1)
+pool.close()
+pool.join()
+assert(sorted(loads) == list(range(20)))
+assert(len(cache) == 5 and cache.nbytes == 5 * 240)
+assert(cache.stats['misses'] == 20 and cache.stats['evictions'] == 15)
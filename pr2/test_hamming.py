@@ -0,0 +1,79 @@
+import os
+import tempfile
+
+import hamming
+from hamming import HammingEmbedding, HammingIndex, popcount, pack_bits
+import numpy as np
+
+random_state = np.random.RandomState(0)
+
+# popcount, with and without np.bitwise_count
+x = random_state.randint(0, 2**62, 1000).astype(np.uint64) * np.uint64(3)
+ref = np.array([bin(int(v)).count('1') for v in x])
+assert(np.array_equal(popcount(x), ref))
+assert(np.array_equal(hamming._POPCOUNT8[x.view(np.uint8)].reshape(-1, 8).sum(1), ref))
+
+bits = random_state.rand(10, 40) > 0.5
+assert(np.array_equal(popcount(pack_bits(bits)), bits.sum(1)))
+assert(np.array_equal(popcount(pack_bits(bits) ^ pack_bits(~bits)), [40] * 10))
+
+# 5 words; descriptors of the same word differ by their offsets
+n_words, ndim = 5, 32
+centers = random_state.randn(n_words, ndim) * 10
+train_words = random_state.randint(0, n_words, 5000)
+train = centers[train_words] + random_state.randn(5000, ndim)
+he = HammingEmbedding(32).fit(train, train_words, n_words, random_state=random_state)
+# median thresholds: balanced bits
+sig_bits = (np.dot(train, he.projection) > he.medians[train_words])
+assert(np.allclose(sig_bits.mean(0), 0.5, atol=0.05))
+
+# near duplicate descriptors have close signatures, others do not
+desc = centers[train_words[:200]] + random_state.randn(200, ndim)
+noisy = desc + 0.05 * random_state.randn(200, ndim)
+d_near = popcount(he.signatures(desc, train_words[:200]) ^ he.signatures(noisy, train_words[:200]))
+d_far = popcount(he.signatures(desc, train_words[:200]) ^ he.signatures(train[200:400], train_words[:200]))
+assert(d_near.mean() < 3 and d_far.mean() > 10)
+
+# database of 10 images, 30 descriptors each; image 3 is the query + noise
+n_docs = 10
+db_words = train_words[:n_docs * 30]
+db_desc = train[:n_docs * 30]
+doc_ids = np.repeat(np.arange(n_docs), 30)
+index = HammingIndex.from_features(n_words, n_docs, doc_ids, db_words,
+                                   he.signatures(db_desc, db_words))
+assert(index.nnz == n_docs * 30)
+q_words = db_words[90:120]
+q_desc = db_desc[90:120] + 0.05 * random_state.randn(30, ndim)
+ids, scores = index.search([q_words], [he.signatures(q_desc, q_words)], 3, threshold=8)
+assert(ids[0, 0] == 3)
+# a loose threshold votes like plain BoVW: every image scores
+S = index.scores(q_words, he.signatures(q_desc, q_words), threshold=32)
+assert(np.all(S > 0) and np.argmax(S) == 3)
+# small chunks give the same scores
+assert(np.allclose(index.scores(q_words, he.signatures(q_desc, q_words), 8, max_pairs=7),
+                   index.scores(q_words, he.signatures(q_desc, q_words), 8)))
+
+filename = os.path.join(tempfile.mkdtemp(), 'he.dat')
+index.names_digest = 'a1b2c3d4e5f6'
+index.save(filename)
+assert(HammingIndex.load(filename).names_digest == 'a1b2c3d4e5f6')
+he.save(filename + '.he')
+assert(np.array_equal(HammingIndex.load(filename).signatures, index.signatures))
+assert(np.array_equal(HammingEmbedding.load(filename + '.he').medians, he.medians))
+
+# adding images gives the index built from all of them at once
+half = doc_ids < 6
+grown = HammingIndex.from_features(n_words, 6, doc_ids[half], db_words[half],
+                                   he.signatures(db_desc[half], db_words[half]))
+grown.add(n_docs + 1, doc_ids[~half], db_words[~half],
+          he.signatures(db_desc[~half], db_words[~half]))
+S_all = index.scores(q_words, he.signatures(q_desc, q_words), 8)
+S_grown = grown.scores(q_words, he.signatures(q_desc, q_words), 8)
+assert(grown.n_docs == n_docs + 1 and np.allclose(S_grown[:n_docs], S_all))
+# image 10 has no descriptors, it never ranks
+assert(S_grown[n_docs] == -np.inf)
+
+# removed images never rank, the others keep their ids
+grown.remove([3])
+ids, scores = grown.search([q_words], [he.signatures(q_desc, q_words)], 3, threshold=8)
+assert(3 not in ids[0] and grown.nnz == index.nnz - 30)
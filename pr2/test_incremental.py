@@ -0,0 +1,82 @@
+import os
+import tempfile
+
+from inverted_index import InvertedIndex
+from incremental import IncrementalIndex
+from search import QueryEngine, bovw_matrix
+import numpy as np
+
+random_state = np.random.RandomState(0)
+n_words = 20
+db_words = [random_state.randint(0, n_words, 15) for _ in range(40)]
+
+
+def build(doc_words):
+    # index of the given {doc_id: words}, rebuilt from scratch
+    n_docs = max(doc_words) + 1
+    D = bovw_matrix([doc_words.get(i, []) for i in range(n_docs)], n_words).toarray()
+    doc_ids, words = np.nonzero(D)
+    nd = [len(doc_words.get(i, [])) for i in range(n_docs)]
+    return InvertedIndex.from_postings(n_words, doc_ids, words, D[doc_ids, words], nd)
+
+
+Q = bovw_matrix([random_state.randint(0, n_words, 10) for _ in range(5)], n_words)
+
+
+def check(index, doc_words):
+    ref = build(doc_words)
+    assert(index.n == ref.n)
+    assert(np.array_equal(index.df, ref.df))
+    assert(np.allclose(index.idf, ref.idf))
+    live = sorted(doc_words)
+    for mode in ('flat', 'cosine', 'tfidf', 'intersection'):
+        S, S_ref = index.scores(Q, mode), QueryEngine(ref).scores(Q, mode)
+        assert(np.allclose(S[:, live], S_ref[:, live], atol=1e-5))
+        assert(np.all(np.isneginf(np.delete(S, live, axis=1))))
+
+
+tmp_dir = tempfile.mkdtemp()
+filename = os.path.join(tmp_dir, 'index.dat')
+live = dict(enumerate(db_words[:30]))
+build(live).save(filename)
+index = IncrementalIndex(InvertedIndex.load(filename), filename)
+
+# additions + removals, from the base and from the delta segment
+for words in db_words[30:]:
+    doc_id = index.add(words)
+    live[doc_id] = words
+for doc_id in (3, 17, 33):
+    index.remove(doc_id)
+    del live[doc_id]
+assert(index.pending == (9, 2))
+check(index, live)
+ids, _ = index.search(Q, 50, mode='cosine')
+assert(ids.shape == (5, len(live)) and not set(ids.ravel()) - set(live))
+
+# merged segment on disk == rebuilt index, with the digest of the names
+index.names_digest = 'a1b2c3d4e5f6'
+index.commit()
+assert(index.pending == (0, 0))
+check(index, live)
+check(IncrementalIndex(InvertedIndex.load(filename), filename), live)
+assert(InvertedIndex.load(filename).names_digest == 'a1b2c3d4e5f6')
+
+# changes made during a background merge stay pending
+index.remove(5)
+del live[5]
+index.commit(background=True)
+doc_id = index.add(db_words[0])
+live[doc_id] = db_words[0]
+index.remove(36)
+del live[36]
+index.wait()
+check(index, live)
+index.commit()
+assert(index.pending == (0, 0))
+check(index, live)
+
+try:
+    index.remove(5)
+    assert(False)
+except KeyError:
+    pass
@@ -0,0 +1,53 @@
+from inverted_index import InvertedIndex
+import numpy as np
+
+# 3 images, 4 visual words
+doc_ids = [0, 0, 1, 2, 2]
+words = [1, 3, 1, 0, 3]
+counts = [2, 1, 5, 1, 3]
+nd = [3, 5, 4]
+index = InvertedIndex.from_postings(4, doc_ids, words, counts, nd)
+
+assert(index.n == 3)
+assert(np.array_equal(index.df, [1, 2, 0, 2]))
+assert(np.array_equal(index.offsets, [0, 1, 3, 3, 5]))
+assert(np.array_equal(index.norm, [3, 5, 4]))
+
+# postings of word 1 then word 3
+pos, ids, weights = index.postings([1, 3])
+assert(np.array_equal(pos, [0, 0, 1, 1]))
+assert(np.array_equal(ids, [0, 1, 0, 2]))
+assert(np.array_equal(weights, [2, 5, 1, 3]))
+
+# empty posting lists yield nothing
+pos, ids, weights = index.postings([2])
+assert(len(pos) == 0 and len(ids) == 0)
+
+# binary index file, opened through memory maps
+import os
+import tempfile
+index_file = os.path.join(tempfile.mkdtemp(), 'index.dat')
+vocabulary = np.arange(8, dtype=np.float32).reshape(4, 2)
+index.save(index_file, vocabulary)
+loaded = InvertedIndex.load(index_file)
+assert(isinstance(loaded.doc_ids, np.memmap))
+assert(loaded.n == index.n and loaded.n_docs == index.n_docs)
+for name in ('df', 'idf', 'norm', 'nd', 'offsets', 'doc_ids', 'weights'):
+    assert(np.array_equal(getattr(loaded, name), getattr(index, name)))
+assert(np.array_equal(loaded.vocabulary, vocabulary))
+pos, ids, weights = loaded.postings([1, 3])
+assert(np.array_equal(ids, [0, 1, 0, 2]))
+assert(loaded.names_digest == '')
+index.names_digest = 'a1b2c3d4e5f6'
+index.save(index_file, vocabulary)
+loaded = InvertedIndex.load(index_file)
+assert(loaded.names_digest == 'a1b2c3d4e5f6')
+
+# saving again renames a new file over the old one, which the open index
+# keeps reading
+index.save(index_file)
+assert(not os.path.exists(index_file + '.tmp'))
+assert(np.array_equal(loaded.doc_ids, index.doc_ids))
+assert(np.array_equal(InvertedIndex.load(index_file).vocabulary, vocabulary))
+del loaded, pos, ids, weights
+os.remove(index_file)
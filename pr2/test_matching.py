@@ -0,0 +1,31 @@
+from matching import QueryMatcher
+import numpy as np
+
+random_state = np.random.RandomState(0)
+desc_db = random_state.rand(50, 16)
+
+# the first 20 query features are noisy copies of database features 10..29
+desc_q = random_state.rand(40, 16)
+desc_q[:20] = desc_db[10:30] + 0.01 * random_state.randn(20, 16)
+
+qi, di = QueryMatcher(desc_q, ratio=0.8).match(desc_db)
+assert(np.array_equal(qi[qi < 20], np.arange(20)))
+assert(np.array_equal(di[qi < 20], np.arange(10, 30)))
+assert(np.sum(qi >= 20) < 10)  # random features rarely pass the ratio test
+
+qi, di = QueryMatcher(desc_q, ratio=None, mutual=True).match(desc_db)
+assert(np.all(np.isin(np.arange(20), qi)))
+dist2 = ((desc_q[qi, None, :] - desc_db[None, :, :]) ** 2).sum(-1)
+assert(np.array_equal(np.argmin(dist2, axis=1), di))
+
+qi, di = QueryMatcher(desc_q).match(np.zeros((0, 16)))
+assert(len(qi) == 0 and len(di) == 0)
+
+# word matching: word 3 appears twice in the query and is skipped
+words_q = np.array([5, 3, 7, 3, 1])
+words_db = np.array([1, 2, 3, 5, 9, 5])
+qi, di = QueryMatcher(desc_q[:5], words=words_q).match_words(words_db)
+assert(sorted(zip(qi, di)) == [(4, 0)])   # word 5 appears twice in db
+
+qi, di = QueryMatcher(desc_q[:5], words=words_q, max_per_word=2).match_words(words_db)
+assert(sorted(zip(qi, di)) == [(0, 3), (0, 5), (1, 2), (3, 2), (4, 0)])
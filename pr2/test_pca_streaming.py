@@ -0,0 +1,36 @@
+from pca import PCA, randomized_eigh
+import numpy as np
+
+random_state = np.random.RandomState(0)
+X = random_state.randn(20000, 16) * np.linspace(5, 0.1, 16) + 3.
+X = np.dot(X, np.linalg.qr(random_state.randn(16, 16))[0])
+
+# chunked statistics == those of the whole matrix
+pca = PCA().fit(np.array_split(X, 7))
+assert(pca.n_samples == len(X))
+assert(np.allclose(pca.mean, X.mean(0), atol=1e-5))
+assert(np.allclose(pca._scatter / len(X), np.cov(X.T, bias=True)))
+eigvals = np.linalg.eigvalsh(np.cov(X.T, bias=True))[::-1]
+assert(np.allclose(pca.explained_variance, eigvals))
+assert(pca.components.shape == (16, 16))
+assert(np.all(np.diff(pca.explained_variance) <= 0))
+
+# any iterable of batches, e.g. a generator reading them one at a time
+gpca = PCA().fit(X[i:i + 1000] for i in range(0, len(X), 1000))
+assert(gpca.n_samples == len(X) and np.allclose(gpca._scatter, pca._scatter))
+
+# randomized top components span the same subspace
+rpca = PCA(n_components=4, method='randomized', random_state=random_state)
+rpca.fit(np.array_split(X, 3))
+assert(rpca.components.shape == (16, 4))
+assert(np.allclose(rpca.explained_variance, eigvals[:4], rtol=1e-4))
+overlap = np.dot(rpca.components.T, pca.components[:, :4])
+assert(np.allclose(np.abs(overlap), np.eye(4), atol=1e-3))
+
+# projected data is uncorrelated, with the component variances
+Y = pca.transform(X, 4)
+assert(Y.shape == (20000, 4))
+assert(np.allclose(np.cov(Y.T, bias=True), np.diag(eigvals[:4]), atol=1e-2))
+
+vals, vects = randomized_eigh(np.diag([1., 5., 3.]), 2, n_oversamples=1)
+assert(np.allclose(vals, [5., 3.]))
@@ -0,0 +1,41 @@
+import os
+import tempfile
+
+from pq import ProductQuantizer
+from matching import QueryMatcher
+import numpy as np
+
+random_state = np.random.RandomState(0)
+
+# clustered 32-d data
+centers = random_state.randn(50, 32) * 3
+X = centers[random_state.randint(0, 50, 5000)] + 0.3 * random_state.randn(5000, 32)
+
+pq = ProductQuantizer(n_subspaces=8, n_centroids=64).fit(X, random_state=random_state)
+codes = pq.encode(X)
+assert(codes.shape == (5000, 8) and codes.dtype == np.uint8)
+# 8 bytes instead of 32 float32 values
+assert(X.astype(np.float32).nbytes // codes.nbytes == 16)
+
+rel_err = np.sum((pq.decode(codes) - X) ** 2) / np.sum((X - X.mean(0)) ** 2)
+assert(rel_err < 0.05)
+
+# ADC == distance to the reconstructed descriptors
+Q = X[:20] + 0.1 * random_state.randn(20, 32)
+dist2 = pq.adc(pq.distance_tables(Q), codes[:300])
+ref = np.sum((Q[:, None, :] - pq.decode(codes[:300])[None]) ** 2, axis=2)
+assert(np.allclose(dist2, ref, rtol=1e-4, atol=1e-3))
+
+# matching against codes finds (mostly) the same neighbours as raw matching;
+# neighbours in the same blob are a few quantization errors apart, so a few
+# of the 20 queries can pick another one
+matcher = QueryMatcher(Q, ratio=None, pq=pq)
+qi, di = matcher.match_codes(codes[:300])
+qi_ref, di_ref = matcher.match(X[:300])
+assert(np.array_equal(qi, qi_ref))
+assert(np.mean(di == di_ref) >= 0.7)
+
+filename = os.path.join(tempfile.mkdtemp(), 'pq.dat')
+pq.save(filename)
+pq2 = ProductQuantizer.load(filename)
+assert(np.array_equal(pq2.encode(X[:100]), codes[:100]))
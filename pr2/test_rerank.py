@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+from __future__ import division
+
+from multiprocessing.pool import ThreadPool
+
+import numpy as np
+
+from rerank import rerank_scores, rerank_order
+
+
+def check(c):
+    return float(c % 7)
+
+candidates = list(range(50))
+serial = rerank_scores(check, candidates)
+pool = ThreadPool(4)
+parallel = rerank_scores(check, candidates, pool)
+assert np.array_equal(serial, parallel)
+
+# stable order by decreasing score
+order = rerank_order(serial)
+assert np.array_equal(order, np.argsort(-serial, kind='mergesort'))
+
+# time budget: late candidates are skipped and keep their order at the end;
+# every check takes one second of a fake clock
+now = [0.]
+def clock():
+    return now[0]
+
+def slow_check(c):
+    now[0] += 1.
+    return float(c % 3)
+
+scores = rerank_scores(slow_check, candidates, time_budget=2.5, clock=clock)
+checked = ~np.isnan(scores)
+assert np.array_equal(np.where(checked)[0], [0, 1, 2])
+order = rerank_order(scores)
+assert np.array_equal(order[:3], [2, 1, 0])
+assert np.array_equal(order[3:], np.arange(3, len(candidates)))
+
+# the budget applies to the pool as well (how many are checked depends on the
+# thread interleaving, not the order)
+now[0] = 0.
+scores = rerank_scores(slow_check, candidates, pool, time_budget=2.5, clock=clock)
+checked = ~np.isnan(scores)
+assert 0 < checked.sum() < len(candidates)
+order = rerank_order(scores)
+assert np.array_equal(order[checked.sum():], np.where(~checked)[0])
+
+pool.close()
+pool.join()
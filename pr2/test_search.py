@@ -0,0 +1,61 @@
+from inverted_index import InvertedIndex
+from search import QueryEngine, bovw_matrix, top_k
+import numpy as np
+
+random_state = np.random.RandomState(0)
+n_words, n_docs = 20, 30
+
+# random database BoVWs + inverted file
+db_words = [random_state.randint(0, n_words, 15) for _ in range(n_docs)]
+D = bovw_matrix(db_words, n_words).toarray()
+doc_ids, words = np.nonzero(D)
+index = InvertedIndex.from_postings(n_words, doc_ids, words, D[doc_ids, words],
+                                    [15] * n_docs)
+engine = QueryEngine(index)
+
+qy_words = [random_state.randint(0, n_words, 10) for _ in range(5)]
+Q = bovw_matrix(qy_words, n_words)
+Qd = Q.toarray()
+
+# brute force references
+Q1, D1 = Qd / Qd.sum(1, keepdims=True), D / D.sum(1, keepdims=True)
+Q2 = Qd / np.linalg.norm(Qd, axis=1, keepdims=True)
+D2 = D / np.linalg.norm(D, axis=1, keepdims=True)
+intersection = np.minimum(Q1[:, None, :], D1[None, :, :]).sum(-1)
+flat = np.dot((Qd > 0) * 1., (D > 0).T * 1.)
+
+assert(np.allclose(engine.scores(Q, 'intersection'), intersection, atol=1e-5))
+assert(np.allclose(engine.scores(Q, 'cosine'), np.dot(Q2, D2.T), atol=1e-5))
+assert(np.allclose(engine.scores(Q, 'flat'), flat))
+
+# other additive kernels between L1-normalized BoVWs
+hellinger = np.sqrt(Q1[:, None, :] * D1[None, :, :]).sum(-1)
+s = Q1[:, None, :] + D1[None, :, :]
+chi2 = np.where(s > 0, 2 * Q1[:, None, :] * D1[None, :, :] / np.where(s > 0, s, 1), 0).sum(-1)
+assert(np.allclose(engine.scores(Q, 'hellinger'), hellinger, atol=1e-5))
+assert(np.allclose(engine.scores(Q, 'chi2'), chi2, atol=1e-5))
+
+# tf-idf: idf-weighted, L2-normalized BoVWs
+idf = np.log(n_docs / ((D > 0).sum(0) + 2**-23))
+Qi, Di = Qd * idf, D * idf
+Qi /= np.linalg.norm(Qi, axis=1, keepdims=True)
+Di /= np.linalg.norm(Di, axis=1, keepdims=True)
+assert(np.allclose(engine.scores(Q, 'tfidf'), np.dot(Qi, Di.T), atol=1e-5))
+
+# queries in batches; only per-document factors are kept, not per-posting arrays
+small = QueryEngine(index, max_cells=2 * n_docs)
+for mode in ('flat', 'cosine', 'tfidf', 'hellinger'):
+    assert(np.allclose(small.scores(Q, mode), engine.scores(Q, mode), atol=1e-6))
+assert(all(len(v) == n_docs for v in engine._dbase.values()))
+
+ids, scores = engine.search(Q, 4, mode='intersection')
+assert(ids.shape == (5, 4))
+assert(np.allclose(scores[:, 0], intersection.max(axis=1), atol=1e-5))
+assert(np.all(np.diff(scores, axis=1) <= 0))
+
+# top-k selection
+x = np.array([0.1, 0.7, 0.3, 0.9, 0.5])
+assert(np.array_equal(top_k(x, 3), [3, 1, 4]))
+assert(np.array_equal(top_k(x, 10), [3, 1, 4, 2, 0]))
+assert(np.array_equal(top_k(np.vstack((x, -x)), 2), [[3, 1], [0, 2]]))
+assert(top_k(x, 0).shape == (0,))
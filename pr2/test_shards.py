@@ -0,0 +1,42 @@
+import os
+import tempfile
+
+from inverted_index import InvertedIndex
+from search import QueryEngine, bovw_matrix
+from shards import ShardedIndex, split_index, shard_filename
+import numpy as np
+
+random_state = np.random.RandomState(0)
+n_words, n_docs, n_shards = 20, 50, 3
+
+db_words = [random_state.randint(0, n_words, 15) for _ in range(n_docs)]
+D = bovw_matrix(db_words, n_words).toarray()
+doc_ids, words = np.nonzero(D)
+index = InvertedIndex.from_postings(n_words, doc_ids, words, D[doc_ids, words],
+                                    [15] * n_docs)
+Q = bovw_matrix([random_state.randint(0, n_words, 10) for _ in range(5)], n_words)
+
+tmp_dir = tempfile.mkdtemp()
+filename = os.path.join(tmp_dir, 'index.dat')
+filenames = [shard_filename(filename, s, n_shards) for s in range(n_shards)]
+for shard, shard_file in zip(split_index(index, n_shards), filenames):
+    shard.save(shard_file)
+
+# same top-k lists as the whole index, whether shards run in processes or not
+for processes in (True, False):
+    sharded = ShardedIndex(filenames, processes=processes)
+    for mode in ('flat', 'cosine', 'tfidf', 'intersection'):
+        S = QueryEngine(index).scores(Q, mode)
+        ids, scores = sharded.search(Q, 7, mode)
+        assert(ids.shape == (5, 7))
+        assert(np.allclose(scores, -np.sort(-S, axis=1)[:, :7], atol=1e-5))
+        assert(np.allclose(np.take_along_axis(S, ids, axis=1), scores, atol=1e-5))
+    # shard servers report their errors as a RuntimeError with the traceback
+    error = RuntimeError if processes else ValueError
+    try:
+        sharded.search(Q, 7, 'bm25')
+    except error:
+        pass
+    else:
+        raise AssertionError('unknown scoring mode accepted')
+    sharded.close()
@@ -11,26 +11,28 @@ from scipy.io import loadmat, savemat
 
 import numpy as np
 
-import shelve
-
 import cv2
 
+sys.path.append(join(split(abspath(__file__))[0], '..', 'common'))
+from dtypes import FLOAT, as_float
+from feature_store import extract_features
+from inverted_index import InvertedIndex
+
 DETECTOR = cv2.xfeatures2d.SURF_create()
 DESCRIPTOR = DETECTOR
+# what the extracted features depend on, to key cached artifacts
+FEATURE_PARAMS = {'descriptor': 'SURF', 'norm': 'signed sqrt', 'dtype': FLOAT.name}
 
 def load_index(filename):
-    fh = shelve.open(filename, 'r')
-    if not 'index' in fh:
-        raise IOError('not an index file')
-    index = fh['index']
-    fh.close()
-    return index
+    return InvertedIndex.load(filename)
 
 
-def save_index(index, filename):
-    fh = shelve.open(filename, flag='n', protocol=2)
-    fh['index'] = index
-    fh.close()
+def save_index(index, filename, vocabulary=None):
+    # if dir/subdir doesn't exist, create it
+    dirname = split(filename)[0]
+    if not exists(dirname):
+        makedirs(dirname)
+    index.save(filename, vocabulary)
 
 
 def load_data(filename):
@@ -97,7 +99,7 @@ def get_random_sample(imlist, impath, n_samples=int(1e5), n_per_file=100, random
         sys.stdout.flush()
 
     print('')
-    samples = np.row_stack(samples).ravel(order='C').reshape(n, -1)
+    samples = as_float(np.row_stack(samples)).reshape(n, -1)
     l1_norm = np.linalg.norm(samples, ord=1, axis=1) + 2**-23
     return np.sign(samples) * np.sqrt(np.abs(samples) / l1_norm.reshape(-1, 1))
 
@@ -106,6 +108,18 @@ def compute_features(imfile):
     im = cv2.imread(imfile, cv2.IMREAD_GRAYSCALE)
     kp = DETECTOR.detect(im)
     kp, desc = DESCRIPTOR.compute(im, kp)
+    desc = as_float(desc).reshape(len(kp), -1)
     l1_norm = np.linalg.norm(desc, ord=1, axis=1) + 2**-23
     desc = np.sign(desc) * np.sqrt(np.abs(desc) / l1_norm.reshape(-1, 1))
     return {'kp': kp2arr(kp), 'desc': desc}
+
+
+def compute_job(job):
+    fname, imfile = job
+    fdict = compute_features(imfile)
+    return fname, fdict['desc'], fdict['kp']
+
+
+def precompute_features(base_path, image_list, store_path, n_workers=None):
+    return extract_features(compute_job, base_path, image_list, store_path,
+                            n_workers)